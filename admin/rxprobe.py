@@ -0,0 +1,774 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2026, Sine Nomine Associates ("SNA")
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND SNA DISCLAIMS ALL WARRANTIES WITH REGARD
+# TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND
+# FITNESS. IN NO EVENT SHALL SNA BE LIABLE FOR ANY SPECIAL, DIRECT, INDIRECT, OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS
+# ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS
+# SOFTWARE.
+#
+# rxprobe.py
+#
+# Query OpenAFS file servers for statistics with the Rx protocol, without
+# running rxdebug or xstat_fs_test.
+#
+# This implements just enough of Rx to make the rxdebug statistics query
+# (rxdebug -rxstats) and the RXAFS_GetXStats call (xstat_fs_test -co N) with
+# the null security class. All calls share one UDP socket, so many calls to
+# many servers may be in flight at once:
+#
+#   >>> import rxprobe
+#   >>> client = rxprobe.RxClient()
+#   >>> calls = [client.start_xstats(host, 7000, 3) for host in hosts]
+#   >>> for call in calls:
+#   ...     print(call.wait())
+#
+# The values are returned as a list of (name, value) pairs, named after the
+# fields of the OpenAFS structures (struct rx_statistics, struct afs_PerfStats,
+# struct fs_stats_DetailedStats and struct cbcounters). Times are returned as
+# float seconds.
+#
+# A stand-in server, which answers the same queries with made up counters,
+# is provided for testing and benchmarks. The reply decoders are checked
+# against fixed replies with:
+#
+#   python -m doctest rxprobe.py
+#
+# usage:
+#   rxprobe.py rxstats <host>[:<port>]
+#   rxprobe.py xstats <host>[:<port>] [-c <collection>]
+#   rxprobe.py serve [-p <port>] [--delay <seconds>] [--loss <fraction>]
+#   rxprobe.py bench [--servers <n>] [--rounds <n>] [--delay <seconds>]
+#
+
+from __future__ import division, print_function
+
+import argparse
+import heapq
+import itertools
+import random
+import select
+import socket
+import struct
+import sys
+import threading
+import time
+
+# Rx packet header.
+RX_HEADER = struct.Struct('!IIIIIBBBBHH')
+
+# Packet types.
+RX_PACKET_TYPE_DATA = 1
+RX_PACKET_TYPE_ACK = 2
+RX_PACKET_TYPE_BUSY = 3
+RX_PACKET_TYPE_ABORT = 4
+RX_PACKET_TYPE_DEBUG = 8
+
+# Packet header flags.
+RX_CLIENT_INITIATED = 1
+RX_REQUEST_ACK = 2
+RX_LAST_PACKET = 4
+
+# Ack packet body, followed by the acks and 3 bytes of padding.
+RX_ACK = struct.Struct('!HHIIIBB')
+RX_ACK_REQUESTED = 1
+RX_ACK_DELAY = 8
+RX_ACK_TYPE_NACK = 0
+RX_ACK_TYPE_ACK = 1
+
+RX_MAXCALLS = 4         # Channels per connection.
+RX_DATA_SIZE = 1412     # Data bytes per packet sent by the stand-in server.
+
+RX_DEBUGI_RXSTATS = 4
+
+FS_SERVICE_ID = 1
+RXAFS_XSTATSVERSION = 154
+RXAFS_GETXSTATS = 155
+AFS_XSTAT_VERSION = 1
+RXGEN_OPCODE = -455
+
+AFS_XSTATSCOLL_CALL_INFO = 0
+AFS_XSTATSCOLL_PERF_INFO = 1
+AFS_XSTATSCOLL_FULL_PERF_INFO = 2
+AFS_XSTATSCOLL_CBSTATS = 3
+
+# The layouts of the statistics are lists of (name, words). A field of one
+# word is a counter, a field of two words is a time in seconds and
+# microseconds. Fields named None are not reported.
+
+RX_PACKET_TYPES = [
+    'data', 'ack', 'busy', 'abort', 'ackall', 'challenge', 'response',
+    'debug', 'params', None, None, None, 'version',
+]
+
+def _counters(names, prefix=''):
+    return [(prefix + name if name else None, 1) for name in names]
+
+def _times(names, prefix=''):
+    return [(prefix + name, 2) for name in names]
+
+def _per_type(prefix):
+    return [(prefix + name if name else None, 1) for name in RX_PACKET_TYPES]
+
+RX_STATS = (
+    _counters([
+        'packetRequests', 'receivePktAllocFailures', 'sendPktAllocFailures',
+        'specialPktAllocFailures', 'socketGreedy', 'bogusPacketOnRead',
+        'bogusHost', 'noPacketOnRead', 'noPacketBuffersOnRead', 'selects',
+        'sendSelects']) +
+    _per_type('packetsRead_') +
+    _counters([
+        'dataPacketsRead', 'ackPacketsRead', 'dupPacketsRead',
+        'spuriousPacketsRead']) +
+    _per_type('packetsSent_') +
+    _counters([
+        'ackPacketsSent', 'pingPacketsSent', 'abortPacketsSent',
+        'busyPacketsSent', 'dataPacketsSent', 'dataPacketsReSent',
+        'dataPacketsPushed', 'ignoreAckedPacket']) +
+    _times(['totalRtt', 'minRtt', 'maxRtt']) +
+    _counters([
+        'nRttSamples', 'nServerConns', 'nClientConns', 'nPeerStructs',
+        'nCallStructs', 'nFreeCallStructs', 'netSendFailures', 'fatalErrors',
+        'ignorePacketDally', 'receiveCbufPktAllocFailures',
+        'sendCbufPktAllocFailures', 'nBusies', None, None, None, None])
+)
+
+FS_OVERALL_STATS = (
+    _counters([
+        'numPerfCalls',
+        'vcache_L_Entries', 'vcache_L_Allocs', 'vcache_L_Gets',
+        'vcache_L_Reads', 'vcache_L_Writes', 'vcache_S_Entries',
+        'vcache_S_Allocs', 'vcache_S_Gets', 'vcache_S_Reads',
+        'vcache_S_Writes', 'vcache_H_Entries', 'vcache_H_Gets',
+        'vcache_H_Replacements',
+        'dir_Buffers', 'dir_Calls', 'dir_IOs',
+        'rx_packetRequests', 'rx_noPackets_RcvClass', 'rx_noPackets_SendClass',
+        'rx_noPackets_SpecialClass', 'rx_socketGreedy',
+        'rx_bogusPacketOnRead', 'rx_bogusHost', 'rx_noPacketOnRead',
+        'rx_noPacketBuffersOnRead', 'rx_selects', 'rx_sendSelects',
+        'rx_packetsRead_RcvClass', 'rx_packetsRead_SendClass',
+        'rx_packetsRead_SpecialClass', 'rx_dataPacketsRead',
+        'rx_ackPacketsRead', 'rx_dupPacketsRead', 'rx_spuriousPacketsRead',
+        'rx_packetsSent_RcvClass', 'rx_packetsSent_SendClass',
+        'rx_packetsSent_SpecialClass', 'rx_ackPacketsSent',
+        'rx_pingPacketsSent', 'rx_abortPacketsSent', 'rx_busyPacketsSent',
+        'rx_dataPacketsSent', 'rx_dataPacketsReSent', 'rx_dataPacketsPushed',
+        'rx_ignoreAckedPacket']) +
+    _times(['rx_totalRtt', 'rx_minRtt', 'rx_maxRtt']) +
+    _counters([
+        'rx_nRttSamples', 'rx_nServerConns', 'rx_nClientConns',
+        'rx_nPeerStructs', 'rx_nCallStructs', 'rx_nFreeCallStructs',
+        'host_NumHostEntries', 'host_HostBlocks', 'host_NonDeletedHosts',
+        'host_HostsInSameNetOrSubnet', 'host_HostsInDiffSubnet',
+        'host_HostsInDiffNetwork', 'host_NumClients', 'host_ClientBlocks',
+        'sysname_ID', 'rx_nBusies', 'fs_nBusies', 'fs_nGetCaps'])
+)
+FS_OVERALL_SPARES = 28
+
+FS_RPC_OPS = [
+    'FetchData', 'FetchACL', 'FetchStatus', 'StoreData', 'StoreACL',
+    'StoreStatus', 'RemoveFile', 'CreateFile', 'Rename', 'Symlink', 'Link',
+    'MakeDir', 'RemoveDir', 'SetLock', 'ExtendLock', 'ReleaseLock',
+    'GetStatistics', 'GiveUpCallbacks', 'GetVolumeInfo', 'GetVolumeStatus',
+    'SetVolumeStatus', 'GetRootVolume', 'CheckToken', 'GetTime',
+    'NGetVolumeInfo', 'BulkStatus', 'XStatsVersion', 'GetXStats', 'XLookup',
+]
+FS_XFER_OPS = ['FetchData', 'StoreData']
+
+FS_DETAILED_STATS = _times(['epoch'])
+for _op in FS_RPC_OPS:
+    FS_DETAILED_STATS += (
+        _counters(['numOps', 'numSuccesses'], 'rpc_%s_' % _op) +
+        _times(['sumTime', 'sqrTime', 'minTime', 'maxTime'], 'rpc_%s_' % _op))
+for _op in FS_XFER_OPS:
+    FS_DETAILED_STATS += (
+        _counters(['numXfers', 'numSuccesses'], 'xfer_%s_' % _op) +
+        _times(['sumTime', 'sqrTime', 'minTime', 'maxTime'], 'xfer_%s_' % _op) +
+        _counters(['sumBytes', 'minBytes', 'maxBytes'], 'xfer_%s_' % _op) +
+        _counters(['count%d' % i for i in range(9)], 'xfer_%s_' % _op))
+
+FS_CB_STATS = _counters([
+    'DeleteFiles', 'DeleteCallBacks', 'BreakCallBacks', 'AddCallBacks',
+    'GotSomeSpaces', 'DeleteAllCallBacks', 'nFEs', 'nCBs', 'nblks',
+    'CBsTimedOut', 'nbreakers', 'GSS1', 'GSS2', 'GSS3', 'GSS4', 'GSS5',
+])
+
+# The fields which are levels or limits rather than cumulative counters.
+GAUGES = set([
+    'socketGreedy', 'bogusHost', 'minRtt', 'maxRtt', 'nServerConns',
+    'nClientConns', 'nPeerStructs', 'nCallStructs', 'nFreeCallStructs',
+    'vcache_L_Entries', 'vcache_S_Entries', 'vcache_H_Entries', 'dir_Buffers',
+    'rx_socketGreedy', 'rx_bogusHost', 'rx_minRtt', 'rx_maxRtt',
+    'rx_nServerConns', 'rx_nClientConns', 'rx_nPeerStructs', 'rx_nCallStructs',
+    'rx_nFreeCallStructs', 'host_NumHostEntries', 'host_HostBlocks',
+    'host_NonDeletedHosts', 'host_HostsInSameNetOrSubnet',
+    'host_HostsInDiffSubnet', 'host_HostsInDiffNetwork', 'host_NumClients',
+    'host_ClientBlocks', 'sysname_ID', 'epoch', 'nFEs', 'nCBs', 'nblks',
+    'nbreakers',
+])
+
+def is_counter(name):
+    """Return True if a field is a cumulative counter."""
+    if name in GAUGES:
+        return False
+    return not name.endswith(('_minTime', '_maxTime', '_minBytes', '_maxBytes'))
+
+def layout_size(layout):
+    """Return the number of words of a layout."""
+    return sum(size for name,size in layout)
+
+def decode(layout, words):
+    """Return the (name, value) pairs of the words of a layout.
+
+    Fields missing from the end of the words, as sent by older servers, are
+    left out.
+
+    >>> layout = [('calls', 1), (None, 1), ('time', 2)]
+    >>> decode(layout, [7, 0, 2, 500000])
+    [('calls', 7), ('time', 2.5)]
+    >>> decode(layout, [7, 0, 2])
+    [('calls', 7)]
+    """
+    stats = []
+    i = 0
+    for name,size in layout:
+        if i + size > len(words):
+            break
+        if name is not None:
+            if size == 1:
+                stats.append((name, words[i]))
+            else:
+                stats.append((name, words[i] + words[i+1] / 1000000.0))
+        i += size
+    return stats
+
+def decode_raw(words):
+    return [('word%d' % i, w) for i,w in enumerate(words)]
+
+def decode_perf(words):
+    """Decode the full performance statistics (collection 2).
+
+    The overall statistics end with spares, so the detailed statistics are
+    found from the end of the data."""
+    overall = len(words) - layout_size(FS_DETAILED_STATS)
+    if overall < layout_size(FS_OVERALL_STATS):
+        return decode_raw(words)
+    return (decode(FS_OVERALL_STATS, words[:overall]) +
+            decode(FS_DETAILED_STATS, words[overall:]))
+
+XSTATS_DECODERS = {
+    AFS_XSTATSCOLL_CALL_INFO: decode_raw,
+    AFS_XSTATSCOLL_PERF_INFO: lambda words: decode(FS_OVERALL_STATS, words),
+    AFS_XSTATSCOLL_FULL_PERF_INFO: decode_perf,
+    AFS_XSTATSCOLL_CBSTATS: lambda words: decode(FS_CB_STATS, words),
+}
+
+def decode_xstats(collection, body):
+    """Return the (name, value) pairs of the reply to an RXAFS_GetXStats call.
+
+    The reply is the version, the time of the collection and the number of
+    words, followed by the words. Raises RxError if the reply is truncated.
+
+    >>> body = pack_words([AFS_XSTAT_VERSION, 1792180000, 3, 5, 6, 7])
+    >>> decode_xstats(AFS_XSTATSCOLL_CBSTATS, body)
+    [('DeleteFiles', 5), ('DeleteCallBacks', 6), ('BreakCallBacks', 7)]
+    >>> decode_xstats(AFS_XSTATSCOLL_CALL_INFO, body)
+    [('word0', 5), ('word1', 6), ('word2', 7)]
+    >>> for size in (20, 8):
+    ...     try:
+    ...         decode_xstats(AFS_XSTATSCOLL_CBSTATS, body[:size])
+    ...     except RxError as e:
+    ...         print(e)
+    truncated xstat reply: 3 words in 8 bytes
+    truncated xstat reply: 8 bytes
+    """
+    if len(body) < 12:
+        raise RxError('truncated xstat reply: %d bytes' % len(body))
+    version,when,count = struct.unpack_from('!iiI', body)
+    if count * 4 > len(body) - 12:
+        raise RxError('truncated xstat reply: %d words in %d bytes'
+                      % (count, len(body) - 12))
+    decode_words = XSTATS_DECODERS.get(collection, decode_raw)
+    return decode_words(unpack_words(body, 12, count))
+
+def unpack_words(data, offset=0, count=None):
+    if count is None:
+        count = (len(data) - offset) // 4
+    return struct.unpack_from('!%dI' % count, data, offset)
+
+def pack_words(words):
+    return struct.pack('!%dI' % len(words), *words)
+
+def parse_address(text, port=7000):
+    """Split a 'host[:port]' string into a (host, port) pair."""
+    if ':' in text:
+        text,port = text.rsplit(':', 1)
+    return (text, int(port))
+
+
+class RxError(Exception):
+    """An Rx call failed."""
+
+class RxTimeout(RxError):
+    """An Rx call was not answered in time."""
+
+class RxAbort(RxError):
+    """An Rx call was aborted by the server."""
+    def __init__(self, code):
+        RxError.__init__(self, 'call aborted with code %d' % code)
+        self.code = code
+
+
+class RxCall(object):
+    """An Rx call in flight. Call wait() to get the result."""
+    def __init__(self, client, address, cid, call_number, packet_type,
+                 service_id, payload, decode, deadline):
+        self.client = client
+        self.address = address
+        self.cid = cid
+        self.call_number = call_number
+        self.packet_type = packet_type
+        self.service_id = service_id
+        self.payload = payload
+        self.decode = decode
+        self.deadline = deadline
+        self.data = {}          # Reply data packets by sequence number.
+        self.last = None        # Sequence number of the last reply packet.
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+        self.sent = 0.0
+        self.heard = 0.0
+        self.retry = client.retry
+
+    def wait(self):
+        """Wait for the call to finish and return the decoded result.
+
+        Raises RxError if the call failed or timed out."""
+        while not self.done.wait(1): # Timeout so signals are still handled.
+            pass
+        if self.error:
+            raise self.error
+        try:
+            return self.decode(self.result)
+        except (struct.error, ValueError) as e:
+            raise RxError('bad reply from %s:%d: %s' % (self.address + (e,)))
+
+    def next_seq(self):
+        """Return the first reply sequence number not yet received."""
+        seq = 1
+        while seq in self.data:
+            seq += 1
+        return seq
+
+    def receive(self, packet_type, flags, seq, serial, body, now):
+        """Handle a packet from the server. Called by the receiver thread."""
+        self.heard = now
+        if self.packet_type == RX_PACKET_TYPE_DEBUG:
+            if packet_type == RX_PACKET_TYPE_DEBUG:
+                self.client._finish(self, result=body)
+        elif packet_type == RX_PACKET_TYPE_DATA:
+            self.data.setdefault(seq, body)
+            if flags & RX_LAST_PACKET:
+                self.last = seq
+            if flags & RX_REQUEST_ACK:
+                reason = RX_ACK_REQUESTED
+            else:
+                reason = RX_ACK_DELAY
+            self.client._send_ack(self, serial, reason)
+            if self.last is not None and self.next_seq() > self.last:
+                result = b''.join(self.data[s] for s in range(1, self.last + 1))
+                self.client._finish(self, result=result)
+        elif packet_type == RX_PACKET_TYPE_ABORT and len(body) >= 4:
+            code, = struct.unpack_from('!i', body)
+            self.client._finish(self, error=RxAbort(code))
+        # Acks and busy packets just show the server is alive.
+
+
+class RxClient(object):
+    """An Rx client making calls to many servers over one UDP socket.
+
+    A receiver thread dispatches the replies to the calls in flight, and
+    retransmits the requests which have not been answered, backing off from
+    retry seconds."""
+    def __init__(self, retry=1.0):
+        self.retry = retry
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('', 0))
+        self.sock.setblocking(False)
+        self.epoch = int(time.time()) & 0x7fffffff
+        self.next_cid = random.getrandbits(29) << 2
+        self.serials = itertools.count(1)
+        self.debug_call_numbers = itertools.count(1)
+        self.conns = {}         # Connections by server address.
+        self.calls = {}         # Calls in flight by (cid, call number).
+        self.lock = threading.Lock()
+        self.cond = threading.Condition(self.lock)
+        self.closed = False
+        self.thread = threading.Thread(target=self._receiver, name='rx-receiver')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        self.closed = True
+        self.thread.join()
+        self.sock.close()
+
+    def start_rxstats(self, host, port=7000, timeout=30):
+        """Start an rxdebug statistics query."""
+        payload = struct.pack('!ii', RX_DEBUGI_RXSTATS, 0)
+        decoder = lambda body: decode(RX_STATS, unpack_words(body))
+        return self._start(host, port, RX_PACKET_TYPE_DEBUG, 0, payload,
+                           decoder, timeout)
+
+    def start_xstats(self, host, port=7000, collection=2, timeout=30):
+        """Start an RXAFS_GetXStats call for a data collection."""
+        payload = struct.pack('!Iii', RXAFS_GETXSTATS, AFS_XSTAT_VERSION, collection)
+        decoder = lambda body: decode_xstats(collection, body)
+        return self._start(host, port, RX_PACKET_TYPE_DATA, FS_SERVICE_ID,
+                           payload, decoder, timeout)
+
+    def rxstats(self, host, port=7000, timeout=30):
+        """Return the rx statistics of a server."""
+        return self.start_rxstats(host, port, timeout).wait()
+
+    def xstats(self, host, port=7000, collection=2, timeout=30):
+        """Return a data collection of a file server."""
+        return self.start_xstats(host, port, collection, timeout).wait()
+
+    def _start(self, host, port, packet_type, service_id, payload, decoder, timeout):
+        address = (socket.gethostbyname(host), int(port))
+        deadline = time.time() + timeout
+        with self.lock:
+            if packet_type == RX_PACKET_TYPE_DEBUG:
+                cid = 0
+                call_number = next(self.debug_call_numbers)
+            else:
+                cid,call_number = self._allocate_channel(address, deadline)
+            call = RxCall(self, address, cid, call_number, packet_type,
+                          service_id, payload, decoder, deadline)
+            self.calls[(cid, call_number)] = call
+        self._send_request(call, time.time())
+        return call
+
+    def _allocate_channel(self, address, deadline):
+        """Return a free (cid, call number) on the connection to a server."""
+        conn = self.conns.get(address)
+        if conn is None:
+            # [cid, call number of each channel, busy channels]
+            conn = self.conns[address] = [self.next_cid, [0] * RX_MAXCALLS, set()]
+            self.next_cid = (self.next_cid + RX_MAXCALLS) & 0x7ffffffc
+        cid,call_numbers,busy = conn
+        while len(busy) == RX_MAXCALLS:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise RxTimeout('no free channel to %s:%d' % address)
+            self.cond.wait(remaining)
+        channel = min(set(range(RX_MAXCALLS)) - busy)
+        busy.add(channel)
+        call_numbers[channel] += 1
+        return (cid | channel, call_numbers[channel])
+
+    def _finish(self, call, result=None, error=None):
+        with self.lock:
+            if self.calls.pop((call.cid, call.call_number), None) is None:
+                return # Already finished.
+            if call.cid:
+                conn = self.conns[call.address]
+                conn[2].discard(call.cid & (RX_MAXCALLS - 1))
+                self.cond.notify_all()
+        call.result = result
+        call.error = error
+        call.done.set()
+
+    def _header(self, call, packet_type, flags, seq):
+        return RX_HEADER.pack(self.epoch, call.cid, call.call_number, seq,
+                              next(self.serials), packet_type,
+                              flags | RX_CLIENT_INITIATED, 0, 0, 0,
+                              call.service_id)
+
+    def _sendto(self, packet, address):
+        try:
+            self.sock.sendto(packet, address)
+        except socket.error:
+            pass # Retransmitted later.
+
+    def _send_request(self, call, now):
+        header = self._header(call, call.packet_type, RX_LAST_PACKET, 1)
+        self._sendto(header + call.payload, call.address)
+        call.sent = now
+
+    def _send_ack(self, call, serial, reason):
+        first = call.next_seq()
+        top = max(call.data) if call.data else 0
+        acks = bytearray(RX_ACK_TYPE_ACK if seq in call.data else RX_ACK_TYPE_NACK
+                         for seq in range(first, top + 1))
+        body = RX_ACK.pack(0, 0, first, 0, serial, reason, len(acks))
+        header = self._header(call, RX_PACKET_TYPE_ACK, 0, 0)
+        self._sendto(header + body + bytes(acks) + b'\0\0\0', call.address)
+        call.sent = time.time()
+
+    def _receiver(self):
+        check = 0.0
+        while not self.closed:
+            select.select([self.sock], [], [], 0.1)
+            now = time.time()
+            while True:
+                try:
+                    packet,address = self.sock.recvfrom(65536)
+                except socket.error:
+                    break # No more packets.
+                self._dispatch(packet, address, now)
+            if now >= check:
+                self._check(now)
+                check = now + 0.1
+
+    def _dispatch(self, packet, address, now):
+        if len(packet) < RX_HEADER.size:
+            return
+        (epoch, cid, call_number, seq, serial, packet_type, flags, status,
+         security, spare, service_id) = RX_HEADER.unpack_from(packet)
+        call = self.calls.get((cid, call_number))
+        if call is None or call.address != address:
+            return # Late or unexpected packet.
+        call.receive(packet_type, flags, seq, serial, packet[RX_HEADER.size:], now)
+
+    def _check(self, now):
+        """Time out expired calls and retransmit the unanswered ones."""
+        with self.lock:
+            calls = list(self.calls.values())
+        for call in calls:
+            if now >= call.deadline:
+                self._finish(call, error=RxTimeout(
+                    'no reply from %s:%d' % call.address))
+            elif now - max(call.sent, call.heard) >= call.retry:
+                if call.data:
+                    self._send_ack(call, 0, RX_ACK_DELAY) # Ask for the rest.
+                else:
+                    self._send_request(call, now)
+                call.retry = min(call.retry * 2, 8.0)
+
+
+class Responder(object):
+    """A stand-in file server answering the rxdebug statistics query and the
+    RXAFS_GetXStats call.
+
+    Each counter grows with the number of queries answered, starting from
+    base, so repeated samples look like a busy server; restart() sets them
+    back. Replies may be delayed and requests dropped at random to exercise
+    the client."""
+    def __init__(self, host='127.0.0.1', port=0, delay=0.0, loss=0.0, base=0):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.sock.setblocking(False)
+        self.address = self.sock.getsockname()
+        self.delay = delay
+        self.loss = loss
+        self.base = base
+        self.queries = 0
+        self.started = int(time.time())
+        self.serials = itertools.count(1)
+        self.pending = []       # Heap of delayed replies.
+        self.closed = False
+        self.thread = None
+
+    def start(self):
+        """Serve in a background thread."""
+        self.thread = threading.Thread(target=self.serve_forever, name='responder')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def close(self):
+        self.closed = True
+        if self.thread:
+            self.thread.join()
+        self.sock.close()
+
+    def serve_forever(self):
+        while not self.closed:
+            timeout = 0.1
+            if self.pending:
+                timeout = max(0, min(timeout, self.pending[0][0] - time.time()))
+            select.select([self.sock], [], [], timeout)
+            while True:
+                try:
+                    packet,address = self.sock.recvfrom(65536)
+                except socket.error:
+                    break
+                if random.random() >= self.loss:
+                    self.handle(packet, address)
+            now = time.time()
+            while self.pending and self.pending[0][0] <= now:
+                when,serial,packet,address = heapq.heappop(self.pending)
+                self.sock.sendto(packet, address)
+
+    def restart(self):
+        """Reset the counters and the start time, as a restarted server."""
+        self.queries = 0
+        self.started = int(time.time())
+
+    def counters(self, count):
+        self.queries += 1
+        return [(self.base + (i + 1) * self.queries) & 0xffffffff for i in range(count)]
+
+    def collection(self, number):
+        """Return the words of a data collection, or None if unknown."""
+        overall = layout_size(FS_OVERALL_STATS) + FS_OVERALL_SPARES
+        sizes = {
+            AFS_XSTATSCOLL_PERF_INFO: overall,
+            AFS_XSTATSCOLL_FULL_PERF_INFO: overall + layout_size(FS_DETAILED_STATS),
+            AFS_XSTATSCOLL_CBSTATS: layout_size(FS_CB_STATS),
+        }
+        if number not in sizes:
+            return None
+        words = self.counters(sizes[number])
+        if number == AFS_XSTATSCOLL_FULL_PERF_INFO:
+            words[overall:overall + 2] = [self.started, 0] # The epoch.
+        return words
+
+    def reply(self, header, packet_type, flags, seq, body, address):
+        packet = RX_HEADER.pack(header[0], header[1], header[2], seq,
+                                next(self.serials), packet_type, flags, 0, 0, 0,
+                                header[10]) + body
+        if self.delay:
+            heapq.heappush(self.pending, (time.time() + self.delay, header[4], packet, address))
+        else:
+            self.sock.sendto(packet, address)
+
+    def handle(self, packet, address):
+        if len(packet) < RX_HEADER.size:
+            return
+        header = RX_HEADER.unpack_from(packet)
+        packet_type = header[5]
+        body = packet[RX_HEADER.size:]
+        if packet_type == RX_PACKET_TYPE_DEBUG and len(body) >= 8:
+            kind,index = struct.unpack_from('!ii', body)
+            if kind == RX_DEBUGI_RXSTATS:
+                words = self.counters(layout_size(RX_STATS))
+                self.reply(header, RX_PACKET_TYPE_DEBUG, 0, 0, pack_words(words), address)
+        elif (packet_type == RX_PACKET_TYPE_DATA and len(body) >= 4 and
+              header[10] == FS_SERVICE_ID):
+            opcode, = struct.unpack_from('!I', body)
+            if opcode == RXAFS_GETXSTATS and len(body) >= 12:
+                version,number = struct.unpack_from('!ii', body, 4)
+                words = self.collection(number)
+                if words is None:
+                    self.reply(header, RX_PACKET_TYPE_ABORT, 0, 0,
+                               struct.pack('!i', 1), address)
+                    return
+                data = struct.pack('!iiI', AFS_XSTAT_VERSION, int(time.time()),
+                                   len(words)) + pack_words(words)
+                chunks = [data[i:i + RX_DATA_SIZE] for i in range(0, len(data), RX_DATA_SIZE)]
+                for seq,chunk in enumerate(chunks, 1):
+                    flags = 0
+                    if seq == len(chunks):
+                        flags = RX_LAST_PACKET | RX_REQUEST_ACK
+                    self.reply(header, RX_PACKET_TYPE_DATA, flags, seq, chunk, address)
+            elif opcode == RXAFS_XSTATSVERSION:
+                self.reply(header, RX_PACKET_TYPE_DATA, RX_LAST_PACKET, 1,
+                           struct.pack('!i', AFS_XSTAT_VERSION), address)
+            else:
+                self.reply(header, RX_PACKET_TYPE_ABORT, 0, 0,
+                           struct.pack('!i', RXGEN_OPCODE), address)
+        # Acks from the client are ignored.
+
+
+def print_stats(stats):
+    for name,value in stats:
+        print(name, value)
+
+def rxstats_command(args):
+    host,port = parse_address(args.server)
+    print_stats(RxClient().rxstats(host, port, args.timeout))
+
+def xstats_command(args):
+    host,port = parse_address(args.server)
+    print_stats(RxClient().xstats(host, port, args.collection, args.timeout))
+
+def serve_command(args):
+    responder = Responder(args.host, args.port, args.delay, args.loss, args.base)
+    print('serving on %s:%d' % responder.address)
+    try:
+        responder.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+def bench_command(args):
+    responders = [Responder(delay=args.delay, loss=args.loss).start()
+                  for i in range(args.servers)]
+    client = RxClient(retry=0.2)
+    def probe(address):
+        return [client.start_rxstats(address[0], address[1]),
+                client.start_xstats(address[0], address[1], 2),
+                client.start_xstats(address[0], address[1], 3)]
+    for label,concurrent in (('sequential', False), ('concurrent', True)):
+        calls = values = 0
+        start = time.time()
+        for i in range(args.rounds):
+            if concurrent:
+                pending = []
+                for responder in responders:
+                    pending.extend(probe(responder.address))
+            else:
+                pending = []
+                for responder in responders:
+                    for call in probe(responder.address):
+                        values += len(call.wait())
+                        calls += 1
+            for call in pending:
+                values += len(call.wait())
+                calls += 1
+        elapsed = time.time() - start
+        print('%-10s %6d calls  %8.3f s  %8.0f calls/s  %9.0f values/s' % (
+              label, calls, elapsed, calls / elapsed, values / elapsed))
+    client.close()
+    for responder in responders:
+        responder.close()
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Query OpenAFS file servers for statistics with Rx.')
+    commands = parser.add_subparsers(dest='command', metavar='<command>')
+    p = commands.add_parser('rxstats', help='print the rx statistics of a server')
+    p.add_argument('server', help='<host>[:<port>]')
+    p.add_argument('-t', '--timeout', type=float, default=30)
+    p.set_defaults(function=rxstats_command)
+    p = commands.add_parser('xstats', help='print a file server data collection')
+    p.add_argument('server', help='<host>[:<port>]')
+    p.add_argument('-c', '--collection', type=int, default=2)
+    p.add_argument('-t', '--timeout', type=float, default=30)
+    p.set_defaults(function=xstats_command)
+    p = commands.add_parser('serve', help='run a stand-in server for testing')
+    p.add_argument('--host', default='127.0.0.1')
+    p.add_argument('-p', '--port', type=int, default=7000)
+    p.add_argument('--delay', type=float, default=0.0, help='reply delay in seconds')
+    p.add_argument('--loss', type=float, default=0.0, help='fraction of requests dropped')
+    p.add_argument('--base', type=int, default=0, help='initial counter value')
+    p.set_defaults(function=serve_command)
+    p = commands.add_parser('bench', help='measure calls to stand-in servers')
+    p.add_argument('--servers', type=int, default=50)
+    p.add_argument('--rounds', type=int, default=10)
+    p.add_argument('--delay', type=float, default=0.0, help='reply delay in seconds')
+    p.add_argument('--loss', type=float, default=0.0, help='fraction of requests dropped')
+    p.set_defaults(function=bench_command)
+    args = parser.parse_args(argv[1:])
+    if not getattr(args, 'function', None):
+        parser.print_help()
+        return 1
+    try:
+        args.function(args)
+    except (RxError, socket.error) as e:
+        sys.stderr.write('rxprobe: %s\n' % e)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
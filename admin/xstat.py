@@ -22,11 +22,10 @@
 #
 # Gather stats from OpenAFS file servers.
 #
-# This tool runs the OpenAFS rxdebug and xstat utilities to gather statisical
-# information from running file servers and cache managers over the network.
-#
-# NOTE: This tool requires a patched version of xstat_fs_test and rxdebug which
-#       provide a more regular output format.
+# This tool gathers the rx statistics (as shown by rxdebug -rxstats) and the
+# xstat data collections 2 and 3 (as shown by xstat_fs_test) from running file
+# servers over the network. The queries are made directly with the Rx protocol
+# by the rxprobe module, so the OpenAFS commands are not required.
 #
 # Example config file:
 #
@@ -37,28 +36,89 @@
 #
 # [collect]
 # destdir = /tmp/xstats
-# sleep = 60
+# interval = 60
 # once = no
+# store = dat
+# rates = yes
+# checkpoint = /tmp/xstats/xstat.checkpoint
+# workers = 16
+# server_timeout = 120
+# command_timeout = 60
 #
 # [cell0]
 # cellname = example.com
+# interval = 300
 # fileservers =
 #     172.16.50.143
 #     172.16.50.144
 #
+# [server 172.16.50.144]
+# interval = 30
+#
+# The stats of each server are collected on fixed wall clock boundaries of
+# its interval, in seconds. The interval may be set for all servers in the
+# [collect] section, for the servers of a cell in the cell section, and for a
+# single server in a section named after the server. (The old 'sleep' option
+# is read as the interval when no interval is given.) The servers sharing an
+# interval are spread evenly across it.
+#
+# Each sample is written as a line:
+#
+#    <start> <host> <port> <name> <value> <duration> <rate>
+#
+# where start is the time the collection from the server started, duration
+# is how long it took, in seconds, and rate is the change of a counter per
+# second since the previous sample of the counter, or '-' when there is none,
+# such as for the first sample, a counter which was reset, or a value which
+# is not a counter. (The rate column is left out when rates is 'no'.) The last
+# sample of each server is saved to the checkpoint file, so the rates carry on
+# when the collector is restarted. Intervals which were skipped, because the
+# previous collection from the server was still running or because the
+# collector fell behind, are written as a gap marker line:
+#
+#    <start> <host> <port> gap <intervals> <seconds> -
+#
+# where start is the time of the first skipped interval.
+#
+# The samples are written to a daily <cellname>-<date>.dat text file when the
+# store option is 'dat', to the compact <cellname>.xdb store (see xstatdb.py)
+# when it is 'xdb', or to both with 'both'. The rates are stored as the
+# metrics named <name>/s. The stored samples of a server are
+# printed with the query command, and existing .dat files are added to the
+# store with the import command:
+#
+#    xstat.py query [--start <time>] [--end <time>] <host>[:<port>] [<metric>]
+#    xstat.py import <cellname>-<date>.dat ...
+#
+# A file server may be given as <address>:<port> when it does not listen on
+# the standard port 7000.
 #
 
+from __future__ import print_function
+
 import os
 import sys
 import errno
 import re
+import math
+import heapq
 import time
 import logging
+import argparse
 import pprint
 import subprocess
 import signal
+import socket
+import threading
+import json
+import array
 import ConfigParser
 
+import rxprobe
+import xstatdb
+
+NAN = float('nan')
+
 LOG_LEVELS = {
     'debug': logging.DEBUG,
     'info': logging.INFO,
@@ -124,10 +184,25 @@ def read_config():
         c.add_section('collect')
     if not c.has_option('collect', 'destdir'):
         c.set('collect', 'destdir', '/tmp/xstats')
-    if not c.has_option('collect', 'sleep'):
-        c.set('collect', 'sleep', '60')
+    if not c.has_option('collect', 'interval'):
+        if c.has_option('collect', 'sleep'): # Old name of the interval.
+            c.set('collect', 'interval', c.get('collect', 'sleep'))
+        else:
+            c.set('collect', 'interval', '60')
     if not c.has_option('collect', 'once'):
         c.set('collect', 'once', 'no')
+    if not c.has_option('collect', 'store'):
+        c.set('collect', 'store', 'dat')
+    if not c.has_option('collect', 'rates'):
+        c.set('collect', 'rates', 'yes')
+    if not c.has_option('collect', 'checkpoint'):
+        c.set('collect', 'checkpoint', os.path.join(c.get('collect', 'destdir'), 'xstat.checkpoint'))
+    if not c.has_option('collect', 'workers'):
+        c.set('collect', 'workers', '16')
+    if not c.has_option('collect', 'server_timeout'):
+        c.set('collect', 'server_timeout', '120')
+    if not c.has_option('collect', 'command_timeout'):
+        c.set('collect', 'command_timeout', '60')
 
     if not c.has_section('cell0'):
         c.add_section('cell0')
@@ -200,61 +275,366 @@ def detect_fileservers(cellname):
     info("Found servers: {}".format(pprint.pformat(uuids)))
     return uuids
 
-def get_usage(command):
-    """Get the command usage as a string."""
-    pathname = which(command)
-    if pathname is None:
-        fatal("Unable to find command '{}' in PATH.".format(command))
-    cmd = [pathname, '-h']
-    p = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-    out,code = p.communicate()
-    return out
-
-def check_commands():
-    """Check the required commands are available."""
-    usage = get_usage('rxdebug')
-    if not '-raw' in usage:
-        fatal("rxdebug is missing the '-raw' option.")
-    usage = get_usage('xstat_fs_test')
-    for option in ['-format', '-delimiter']:
-        if not option in usage:
-            fatal("xstat_fs_test is missing the '{}' option.".format(option))
-
-def xstat_fs(host, collection, out):
-    """Retrieve xstats from a server and write them to the stream."""
-    cmd = [which('xstat_fs_test'), host, '-once', '-co', collection, '-format', 'dsv', '-delimiter', ' ']
-    cmdline = subprocess.list2cmdline(cmd)
-    debug(cmdline)
-    p = subprocess.Popen(cmd, stdout=out, stderr=subprocess.PIPE)
-    with p.stderr:
-        for line in iter(p.stderr.readline, ''):
-            line = line.rstrip()
-            warning("xstat_fs_test: {}".format(line))
-    code = p.wait()
-    if code:
-        error("xstat_fs_test failed ({}): {}".format(code, cmdline))
-
-def rxstats(host, port, out):
-    """Retrieve rxstats from a server and write them to the stream."""
-    cmd = [which('rxdebug'), host, port, '-rxstats', '-noconns', '-raw']
-    cmdline = subprocess.list2cmdline(cmd)
-    timestamp = int(time.time())
-    debug(cmdline)
-    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    with p.stdout:
-        for line in iter(p.stdout.readline, ''):
-            line = line.rstrip()
-            match = re.match(r'(\S+)\s(\S+)', line)
-            if match:
-                name = match.group(1)
-                value = match.group(2)
-                out.write("{} {} {} {} {}\n".format(timestamp, host, port, name, value))
+def collect(client, server, server_timeout, command_timeout):
+    """Collect the stats of one server and return them as a list of
+    (start, host, port, name, value, duration) rows.
+
+    The rx statistics and the xstat collections are requested at once, and
+    each is given at most command_timeout seconds, but no more than
+    server_timeout seconds. Every row is stamped with the start time and the
+    duration of the collection."""
+    host,port = rxprobe.parse_address(server)
+    timeout = min(command_timeout, server_timeout)
+    start = time.time()
+    try:
+        calls = [
+            ('rxstats', client.start_rxstats(host, port, timeout)),
+            ('xstat collection 2', client.start_xstats(host, port, 2, timeout)),
+            ('xstat collection 3', client.start_xstats(host, port, 3, timeout)),
+        ]
+    except (rxprobe.RxError, socket.error) as e:
+        error("Failed to query server {}: {}".format(server, e))
+        return []
+    stats = []
+    for what,call in calls:
+        try:
+            stats.extend(call.wait())
+        except rxprobe.RxError as e:
+            error("Failed to get {} from server {}: {}".format(what, server, e))
+    duration = time.time() - start
+    return [(int(start), host, port, name, value, duration) for name,value in stats]
+
+def gap(timestamp, server, count, interval):
+    """Return the gap marker row for skipped intervals."""
+    host,port = rxprobe.parse_address(server)
+    return (int(timestamp), host, port, 'gap', count, count * interval, None)
+
+class Rates(object):
+    """Convert the cumulative counters of the servers to per second rates.
+
+    The last value of each metric of a server, and the time it was sampled,
+    are kept in arrays indexed by metric number. A metric missing from a
+    collection, because one of the queries of the server failed, keeps its
+    last value, so the rate is computed again from the next sample which has
+    it. A counter which went down is taken to have wrapped around
+    at 32 bits when it was in the upper half of the range and the wrapped
+    difference is less than half the range, and to have been reset otherwise.
+    All the counters of a server are taken to be reset when the start time of
+    its statistics (the xstat 'epoch') changes, as when the file server is
+    restarted. The table is saved to a checkpoint file at most every
+    checkpoint_interval seconds."""
+    def __init__(self, filename, checkpoint_interval=60):
+        self.filename = filename
+        self.checkpoint_interval = checkpoint_interval
+        self.saved = 0
+        self.ids = {}           # Metric numbers by name.
+        self.names = []
+        self.servers = {}       # (epoch, values, times) by (host, port).
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.filename) as f:
+                checkpoint = json.load(f)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                error("Unable to read checkpoint file {}: {}".format(self.filename, e))
+            return
+        except ValueError as e:
+            error("Ignoring invalid checkpoint file {}: {}".format(self.filename, e))
+            return
+        for name in checkpoint['names']:
+            self.number(name)
+        for server in checkpoint['servers']:
+            if checkpoint.get('version', 1) == 1:
+                # One time for all the values of a server.
+                host,port,t,epoch,values = server
+                times = [None if v is None else t for v in values]
             else:
-                warning("rxdebug: {}".format(line))
-    code = p.wait()
-    if code:
-        error("rxdebug failed ({}): {}".format(code, cmdline))
+                host,port,epoch,values,times = server
+            values = array.array('d', [NAN if v is None else v for v in values])
+            times = array.array('d', [NAN if v is None else v for v in times])
+            self.servers[(host, port)] = (epoch, values, times)
+        info("Read the last samples of {} servers from checkpoint file {}".format(
+             len(self.servers), self.filename))
+
+    def save(self, force=False):
+        """Write the table to the checkpoint file."""
+        now = time.time()
+        if not force and now - self.saved < self.checkpoint_interval:
+            return
+        with self.lock:
+            servers = []
+            for (host, port),(epoch, values, times) in self.servers.items():
+                values = [None if math.isnan(v) else v for v in values]
+                times = [None if math.isnan(v) else v for v in times]
+                servers.append([host, port, epoch, values, times])
+            checkpoint = {'version': 2, 'names': self.names, 'servers': servers}
+        tmp = self.filename + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(checkpoint, f)
+            os.rename(tmp, self.filename)
+        except (IOError, OSError) as e:
+            error("Unable to write checkpoint file {}: {}".format(self.filename, e))
+        self.saved = now
+
+    def number(self, name):
+        if name not in self.ids:
+            self.ids[name] = len(self.names)
+            self.names.append(name)
+        return self.ids[name]
+
+    def add(self, rows):
+        """Return the rows of a server collection with the rates added."""
+        if not rows:
+            return []
+        t,host,port = rows[0][:3]
+        epoch = None
+        for row in rows:
+            if row[3] == 'epoch':
+                epoch = row[4]
+        with self.lock:
+            empty = (None, array.array('d'), array.array('d'))
+            last_epoch,last,last_times = self.servers.get((host, port), empty)
+            restarted = epoch is not None and last_epoch is not None and epoch != last_epoch
+            if restarted:
+                info("Counters of server {}:{} were reset".format(host, port))
+                last,last_times = empty[1:]
+            # Start from the last values, so the metrics missing from this
+            # collection keep theirs.
+            values = array.array('d', last)
+            times = array.array('d', last_times)
+            result = []
+            for row in rows:
+                name,value = row[3],row[4]
+                rate = None
+                if name != 'gap':
+                    i = self.number(name)
+                    if i >= len(values):
+                        values.extend([NAN] * (i + 1 - len(values)))
+                        times.extend([NAN] * (i + 1 - len(times)))
+                    previous,elapsed = values[i],t - times[i]
+                    values[i] = value
+                    times[i] = t
+                    if (elapsed > 0 and not math.isnan(previous) and
+                            rxprobe.is_counter(name)):
+                        delta = value - previous
+                        if delta < 0:
+                            if previous >= 2**31 and delta + 2**32 < 2**31:
+                                delta += 2**32 # Wrapped around.
+                            else:
+                                delta = None # Reset.
+                        if delta is not None:
+                            rate = delta / elapsed
+                result.append(row + (rate,))
+            if epoch is None:
+                epoch = last_epoch
+            self.servers[(host, port)] = (epoch, values, times)
+        return result
+
+class Output(object):
+    """Write the rows of a cell to the daily .dat file of the cell, to the
+    xstatdb store of the cell, or to both."""
+    FORMATS = {
+        'dat': ['dat'],
+        'xdb': ['xdb'],
+        'both': ['dat', 'xdb'],
+    }
+
+    def __init__(self, destdir, store, rates):
+        if store not in self.FORMATS:
+            fatal("Invalid store '{}'; expected one of: {}".format(store, ', '.join(sorted(self.FORMATS))))
+        self.destdir = destdir
+        self.formats = self.FORMATS[store]
+        self.rates = rates
+        self.databases = {}
+        self.lock = threading.Lock()
+
+    def filename(self, cellname, timestamp):
+        date = time.strftime('%Y-%m-%d', time.localtime(timestamp))
+        return os.path.join(self.destdir, "{}-{}.dat".format(cellname, date))
+
+    def database(self, cellname):
+        if cellname not in self.databases:
+            path = os.path.join(self.destdir, "{}.xdb".format(cellname))
+            self.databases[cellname] = xstatdb.XStatDB(path)
+        return self.databases[cellname]
+
+    def write(self, cellname, rows):
+        """Append the rows of a server while holding a lock, so the samples
+        of two servers are never interleaved."""
+        if not rows:
+            return
+        with self.lock:
+            if 'dat' in self.formats:
+                with open(self.filename(cellname, rows[0][0]), 'a') as out:
+                    for t,host,port,name,value,duration,rate in rows:
+                        line = "{} {} {} {} {} {:.3f}".format(t, host, port, name, value, duration)
+                        if self.rates:
+                            line += " -" if rate is None else " {:.6g}".format(rate)
+                        out.write(line + "\n")
+            if 'xdb' in self.formats:
+                # The duration is stored once per collection, as a metric.
+                samples = {}
+                for t,host,port,name,value,duration,rate in rows:
+                    if (host, port) not in samples:
+                        samples[(host, port)] = []
+                        if name != 'gap':
+                            samples[(host, port)].append((t, 'duration', duration))
+                    samples[(host, port)].append((t, name, value))
+                    if rate is not None:
+                        samples[(host, port)].append((t, name + '/s', rate))
+                for (host, port),values in samples.items():
+                    self.database(cellname).append(host, port, values)
 
+class Collector(object):
+    """Collect stats from many servers at once with a pool of worker threads.
+
+    The stats of each server are collected in memory and then written
+    to the output of its cell."""
+    def __init__(self, client, output, rates, workers, server_timeout, command_timeout):
+        self.client = client
+        self.output = output
+        self.rates = rates
+        self.server_timeout = server_timeout
+        self.command_timeout = command_timeout
+        self.tasks = []
+        self.pending = 0
+        self.busy = set()
+        self.cond = threading.Condition()
+        for i in range(workers):
+            thread = threading.Thread(target=self.worker, name='worker-{}'.format(i))
+            thread.daemon = True
+            thread.start()
+
+    def worker(self):
+        while True:
+            with self.cond:
+                while not self.tasks:
+                    self.cond.wait()
+                task = self.tasks.pop(0)
+            try:
+                self.collect(*task)
+            except Exception as e:
+                error("Exception: {}".format(e))
+            finally:
+                with self.cond:
+                    self.pending -= 1
+                    self.busy.discard(task)
+                    self.cond.notify_all()
+
+    def collect(self, server, cellname):
+        rows = collect(self.client, server, self.server_timeout, self.command_timeout)
+        if self.rates:
+            rows = self.rates.add(rows)
+        else:
+            rows = [row + (None,) for row in rows]
+        if not rows:
+            warning("No stats were written for server {} of cell {}".format(server, cellname))
+            return
+        self.output.write(cellname, rows)
+        info("Wrote stats for server {} of cell {}".format(server, cellname))
+
+    def submit(self, server, cellname):
+        """Queue a server for collection.
+
+        Returns False if the server is still being collected."""
+        task = (server, cellname)
+        with self.cond:
+            if task in self.busy:
+                return False
+            self.busy.add(task)
+            self.tasks.append(task)
+            self.pending += 1
+            self.cond.notify_all()
+        return True
+
+    def wait(self):
+        """Wait until all the queued servers are collected."""
+        with self.cond:
+            while self.pending:
+                self.cond.wait(1) # Timeout so signals are still handled.
+
+    def sweep(self, servers):
+        """Collect the stats for a list of (server, cellname) pairs and wait
+        until all are done."""
+        start = time.time()
+        for server,cellname in servers:
+            self.submit(server, cellname)
+        self.wait()
+        info("Collected stats for {} servers in {:.1f} seconds".format(
+             len(servers), time.time() - start))
+
+def next_slot(now, interval, offset):
+    """Return the first interval boundary, shifted by offset, at or after now."""
+    return math.ceil((now - offset) / interval) * interval + offset
+
+class Scheduler(object):
+    """Collect the stats of each server on fixed wall clock boundaries.
+
+    The servers sharing an interval are spread evenly across it. An interval
+    is skipped when the previous collection of the server is still running,
+    or when it has already passed by the time the collector gets to it. A gap
+    marker is written for the skipped intervals."""
+    def __init__(self, collector, servers):
+        self.collector = collector
+        self.queue = [] # Heap of (due, cellname, server, interval).
+        groups = {}
+        for cellname,server,interval in servers:
+            groups.setdefault(interval, []).append((cellname, server))
+        now = time.time()
+        for interval,members in groups.items():
+            for i,(cellname,server) in enumerate(members):
+                offset = interval * i / len(members)
+                due = next_slot(now, interval, offset)
+                self.queue.append((due, cellname, server, interval))
+        heapq.heapify(self.queue)
+
+    def run(self, rates=None):
+        """Collect stats until stopped by a signal."""
+        while running and self.queue:
+            if rates:
+                rates.save()
+            due,cellname,server,interval = self.queue[0]
+            now = time.time()
+            if now < due:
+                if due - now > interval: # The clock was set back.
+                    due = next_slot(now, interval, due % interval)
+                    heapq.heapreplace(self.queue, (due, cellname, server, interval))
+                else:
+                    time.sleep(min(due - now, 1)) # Wake up to handle signals.
+                continue
+            missed = int((now - due) // interval)
+            if missed:
+                warning("Missed {} intervals for server {}".format(missed, server))
+                self.collector.output.write(cellname, [gap(due, server, missed, interval)])
+                due += missed * interval
+            if not self.collector.submit(server, cellname):
+                warning("Still collecting stats for server {}; skipping interval".format(server))
+                self.collector.output.write(cellname, [gap(due, server, 1, interval)])
+            heapq.heapreplace(self.queue, (due + interval, cellname, server, interval))
+
+def read_servers(config):
+    """Return the (cellname, server, interval) of each configured server."""
+    servers = []
+    for section in config.sections():
+        if section.startswith('cell'):
+            cellname = config.get(section, 'cellname')
+            if config.has_option(section, 'interval'):
+                cell_interval = config.getfloat(section, 'interval')
+            else:
+                cell_interval = config.getfloat('collect', 'interval')
+            for server in config.get(section, 'fileservers').strip().split():
+                interval = cell_interval
+                server_section = 'server {}'.format(server)
+                if config.has_option(server_section, 'interval'):
+                    interval = config.getfloat(server_section, 'interval')
+                if interval <= 0:
+                    fatal("Invalid interval {} for server {}.".format(interval, server))
+                servers.append((cellname, server, interval))
+    return servers
 
 running = True
 def sigint_handler(signal, frame):
@@ -263,42 +643,101 @@ def sigint_handler(signal, frame):
     info("Signal SIGINT caught.")
     running = False
 
-def main():
+def parse_time(text):
+    """Convert an epoch time or a local 'YYYY-MM-DD[ HH:MM[:SS]]' time to
+    seconds since the epoch."""
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return time.mktime(time.strptime(text, fmt))
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError("invalid time '{}'".format(text))
+
+def collect_command(config, args):
     global running
 
-    config = read_config()
-    setup_logging(config.get('logging','filename'), config.get('logging','level'))
     destdir = os.path.expanduser(config.get('collect', 'destdir'))
     mkdirp(destdir)
-    check_commands() # Exits if the required commands are missing.
+
+    rates = None
+    if config.getboolean('collect', 'rates'):
+        rates = Rates(os.path.expanduser(config.get('collect', 'checkpoint')))
+    output = Output(destdir, config.get('collect', 'store'), rates is not None)
+    collector = Collector(rxprobe.RxClient(), output, rates,
+                          config.getint('collect', 'workers'),
+                          config.getfloat('collect', 'server_timeout'),
+                          config.getfloat('collect', 'command_timeout'))
+
+    servers = read_servers(config)
+    scheduler = Scheduler(collector, servers)
 
     info('Starting main loop.')
     signal.signal(signal.SIGINT, sigint_handler)
-    while running:
-        for section in config.sections():
-            if section.startswith('cell'):
-                cellname = config.get(section, 'cellname')
-                servers = config.get(section, 'fileservers').strip().split()
-                timestamp = time.strftime('%Y-%m-%d')
-                filename = os.path.join(destdir, "{}-{}.dat".format(cellname, timestamp))
-                for server in servers:
-                    with open(filename, 'a') as out:
-                        try:
-                            rxstats(server, '7000', out)
-                            xstat_fs(server, '2', out)
-                            xstat_fs(server, '3', out)
-                        except Exception as e:
-                            error("Exception: {}".format(e))
-                    info("Wrote stats for server {} to file {}".format(server, filename))
-        if running:
-            if config.getboolean('collect', 'once'):
-                info("Once option set, quitting.")
-                running = False
-            else:
-                sleep = int(config.get('collect', 'sleep'))
-                debug('sleep {}'.format(sleep))
-                time.sleep(sleep)
+    if config.getboolean('collect', 'once'):
+        collector.sweep([(s, c) for c,s,i in servers])
+        info("Once option set, quitting.")
+    else:
+        scheduler.run(rates)
+        collector.wait()
+    if rates:
+        rates.save(force=True)
     info('Exiting.')
 
+def database(config, cellname):
+    """Open the xstatdb store of a cell."""
+    destdir = os.path.expanduser(config.get('collect', 'destdir'))
+    if cellname is None:
+        cellname = config.get('cell0', 'cellname')
+    return xstatdb.XStatDB(os.path.join(destdir, "{}.xdb".format(cellname)))
+
+def query_command(config, args):
+    db = database(config, args.cell)
+    host,port = rxprobe.parse_address(args.server)
+    if args.metric is None:
+        for name in db.metrics():
+            print(name)
+        return
+    for t,value in db.query(host, args.metric, args.start, args.end, port):
+        print("{} {}".format(int(t) if t == int(t) else t, value))
+
+def import_command(config, args):
+    for filename in args.files:
+        cellname = args.cell
+        if cellname is None:
+            match = re.match(r'(.+)-\d{4}-\d{2}-\d{2}\.dat$', os.path.basename(filename))
+            if not match:
+                fatal("Unable to find the cellname of file {}; use --cell.".format(filename))
+            cellname = match.group(1)
+        with open(filename) as f:
+            imported,skipped = database(config, cellname).import_dat(f)
+        info("Imported {} samples from file {} into cell {} ({} lines skipped)".format(
+             imported, filename, cellname, skipped))
+
+def main():
+    parser = argparse.ArgumentParser(description="Gather stats from OpenAFS file servers.")
+    commands = parser.add_subparsers(dest='command', metavar='<command>')
+    p = commands.add_parser('collect', help='collect stats (the default)')
+    p.set_defaults(function=collect_command)
+    p = commands.add_parser('query', help='print a metric of a server from the xstatdb store')
+    p.add_argument('--cell', help='cell name (default: the cell of the [cell0] section)')
+    p.add_argument('--start', type=parse_time, help='first time (epoch or YYYY-MM-DD[ HH:MM[:SS]])')
+    p.add_argument('--end', type=parse_time, help='last time (epoch or YYYY-MM-DD[ HH:MM[:SS]])')
+    p.add_argument('server', help='<host>[:<port>]')
+    p.add_argument('metric', nargs='?', help='metric name (default: list the metric names)')
+    p.set_defaults(function=query_command)
+    p = commands.add_parser('import', help='import .dat files into the xstatdb store')
+    p.add_argument('--cell', help='cell name (default: from the file name)')
+    p.add_argument('files', nargs='+', metavar='file')
+    p.set_defaults(function=import_command)
+    args = parser.parse_args(sys.argv[1:] or ['collect'])
+
+    config = read_config()
+    setup_logging(config.get('logging','filename'), config.get('logging','level'))
+    args.function(config, args)
+
 if __name__ == "__main__":
     main()
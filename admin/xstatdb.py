@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2026, Sine Nomine Associates ("SNA")
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND SNA DISCLAIMS ALL WARRANTIES WITH REGARD
+# TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND
+# FITNESS. IN NO EVENT SHALL SNA BE LIABLE FOR ANY SPECIAL, DIRECT, INDIRECT, OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS
+# ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS
+# SOFTWARE.
+#
+# xstatdb.py
+#
+# A compact, append-only store for the samples gathered by xstat.py.
+#
+# A store is a directory holding the samples of the servers of one cell:
+#
+#   names               the metric names, one per line; a metric is referred
+#                       to by its line number. Names are added while holding
+#                       a lock on the file, so the collector and an import
+#                       may add names to the same store.
+#   <host>-<port>.jnl   the latest samples of a server, as fixed size
+#                       (metric, time, value) records
+#   <host>-<port>.blk   the older samples of a server, in blocks
+#   <host>-<port>.idx   the time range, offset and length of each block
+#
+# Once the journal of a server spans more than an hour it is folded into a
+# block. A block holds a column for each metric, a zlib compressed array of
+# the time and value deltas, so a query reads only the index of the server,
+# and the one column of the blocks overlapping the time range. The journal,
+# which is read by queries too, is removed only after its block is indexed;
+# a crash between the two is harmless since queries drop duplicate samples.
+#
+# Example usage:
+#
+#   >>> import xstatdb
+#   >>> db = xstatdb.XStatDB('/tmp/xstats/example.com.xdb')
+#   >>> db.append('172.16.50.143', 7000, [(1792180000, 'nFEs', 1234)])
+#   >>> db.query('172.16.50.143', 'nFEs', start=1792170000)
+#   [(1792180000, 1234)]
+#
+
+from __future__ import division
+
+import fcntl
+import os
+import struct
+import threading
+import zlib
+
+JOURNAL = struct.Struct('<Idd')         # metric, time, value
+INDEX = struct.Struct('<ddQI')          # first time, last time, offset, length
+COLUMN = struct.Struct('<IBII')         # metric, kind, count, length
+
+KIND_FLOAT = 0                          # Values stored as doubles.
+KIND_INT = 1                            # Values stored as integer deltas.
+
+def encode_column(times, values):
+    """Return the compressed column of the (sorted) times and values."""
+    count = len(times)
+    millis = [int(round(t * 1000)) for t in times]
+    deltas = [millis[0]] + [b - a for a,b in zip(millis, millis[1:])]
+    data = struct.pack('<%dq' % count, *deltas)
+    if all(abs(v) < 2**62 and v == int(v) for v in values):
+        kind = KIND_INT
+        ints = [int(v) for v in values]
+        deltas = [ints[0]] + [b - a for a,b in zip(ints, ints[1:])]
+        data += struct.pack('<%dq' % count, *deltas)
+    else:
+        kind = KIND_FLOAT
+        data += struct.pack('<%dd' % count, *values)
+    return kind, zlib.compress(data, 6)
+
+def decode_column(kind, count, blob):
+    """Return the times and values of a compressed column."""
+    data = zlib.decompress(blob)
+    times = []
+    t = 0
+    for delta in struct.unpack_from('<%dq' % count, data):
+        t += delta
+        times.append(t / 1000)
+    if kind == KIND_INT:
+        values = []
+        v = 0
+        for delta in struct.unpack_from('<%dq' % count, data, count * 8):
+            v += delta
+            values.append(v)
+    else:
+        values = list(struct.unpack_from('<%dd' % count, data, count * 8))
+    return times, values
+
+def read_records(filename, record):
+    """Return the complete records of a file, or an empty list."""
+    try:
+        with open(filename, 'rb') as f:
+            data = f.read()
+    except IOError:
+        return []
+    count = len(data) // record.size # Ignore a partly written record.
+    return [record.unpack_from(data, i * record.size) for i in range(count)]
+
+def number(text):
+    """Convert a value to an int if possible, otherwise to a float."""
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+class XStatDB(object):
+    """An append-only store of the samples of the servers of a cell.
+
+    Samples are appended to the journal of a server, and the journal is
+    folded into a block of compressed per-metric columns once it spans more
+    than span seconds. One writer may append while other processes query."""
+    def __init__(self, path, span=3600):
+        self.path = path
+        self.span = span
+        self.lock = threading.Lock()
+        self.first = {}         # Time of the first journal record by server.
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.names = []
+        self.ids = {}
+        self._load_names()
+
+    def _load_names(self):
+        try:
+            with open(os.path.join(self.path, 'names')) as f:
+                names = f.read().split('\n')[:-1] # Ignore a partly written name.
+        except IOError:
+            names = []
+        for name in names[len(self.names):]:
+            self.ids[name] = len(self.names)
+            self.names.append(name)
+
+    def _intern(self, name):
+        """Return the id of a metric name, adding the name if it is new.
+
+        The names file is locked, and read again, before a name is added,
+        since another process may have added names to the store since it was
+        last read, and the id of a name is its line number."""
+        if name not in self.ids:
+            with open(os.path.join(self.path, 'names'), 'a') as f:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                try:
+                    self._load_names()
+                    if name not in self.ids:
+                        f.write(name + '\n')
+                        f.flush()
+                        self.ids[name] = len(self.names)
+                        self.names.append(name)
+                finally:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        return self.ids[name]
+
+    def _filename(self, host, port, suffix):
+        return os.path.join(self.path, '{}-{}.{}'.format(host, port, suffix))
+
+    def servers(self):
+        """Return the (host, port) of each server in the store."""
+        servers = set()
+        for filename in os.listdir(self.path):
+            base,ext = os.path.splitext(filename)
+            if ext in ('.jnl', '.idx') and '-' in base:
+                host,port = base.rsplit('-', 1)
+                servers.add((host, int(port)))
+        return sorted(servers)
+
+    def metrics(self):
+        """Return the metric names in the store."""
+        self._load_names()
+        return list(self.names)
+
+    def append(self, host, port, samples):
+        """Append the (time, name, value) samples of a server."""
+        with self.lock:
+            key = (host, port)
+            journal = self._filename(host, port, 'jnl')
+            if key not in self.first:
+                records = read_records(journal, JOURNAL)
+                self.first[key] = records[0][1] if records else None
+            records = []
+            for t,name,value in samples:
+                first = self.first[key]
+                if first is not None and t - first >= self.span:
+                    self._write_journal(journal, records)
+                    records = []
+                    self._fold(host, port)
+                    first = None
+                if first is None:
+                    self.first[key] = t
+                records.append(JOURNAL.pack(self._intern(name), t, value))
+            self._write_journal(journal, records)
+
+    def _write_journal(self, journal, records):
+        if records:
+            with open(journal, 'ab') as f:
+                f.write(b''.join(records))
+
+    def flush(self):
+        """Fold the journals of all the servers into blocks."""
+        with self.lock:
+            for host,port in self.servers():
+                self._fold(host, port)
+
+    def _fold(self, host, port):
+        """Write the journal of a server as a block and remove the journal."""
+        journal = self._filename(host, port, 'jnl')
+        records = read_records(journal, JOURNAL)
+        self.first[(host, port)] = None
+        if not records:
+            return
+        columns = {}
+        for metric,t,value in records:
+            columns.setdefault(metric, []).append((t, value))
+        header = [struct.pack('<I', len(columns))]
+        blobs = []
+        for metric in sorted(columns):
+            samples = sorted(columns[metric], key=lambda s: s[0])
+            kind,blob = encode_column([s[0] for s in samples], [s[1] for s in samples])
+            header.append(COLUMN.pack(metric, kind, len(samples), len(blob)))
+            blobs.append(blob)
+        block = b''.join(header + blobs)
+        times = [r[1] for r in records]
+        with open(self._filename(host, port, 'blk'), 'ab') as f:
+            f.seek(0, os.SEEK_END)
+            offset = f.tell()
+            f.write(block)
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self._filename(host, port, 'idx'), 'ab') as f:
+            f.write(INDEX.pack(min(times), max(times), offset, len(block)))
+            f.flush()
+            os.fsync(f.fileno())
+        os.remove(journal)
+
+    def _read_column(self, f, offset, metric):
+        """Return the times and values of a metric in the block at offset."""
+        f.seek(offset)
+        ncolumns, = struct.unpack('<I', f.read(4))
+        directory = f.read(ncolumns * COLUMN.size)
+        position = offset + 4 + len(directory)
+        for i in range(ncolumns):
+            column,kind,count,length = COLUMN.unpack_from(directory, i * COLUMN.size)
+            if column == metric:
+                f.seek(position)
+                return decode_column(kind, count, f.read(length))
+            position += length
+        return [], []
+
+    def query(self, host, name, start=None, end=None, port=7000):
+        """Return the (time, value) samples of a metric of a server, between
+        the start and end times (inclusive), in time order."""
+        self._load_names()
+        metric = self.ids.get(name)
+        if metric is None:
+            return []
+        samples = {}
+        # Read the journal before the index so samples moved into a block in
+        # the meantime are found twice rather than not at all.
+        for m,t,value in read_records(self._filename(host, port, 'jnl'), JOURNAL):
+            if m == metric:
+                if abs(value) < 2**53 and value == int(value):
+                    value = int(value)
+                samples.setdefault(t, value)
+        blocks = []
+        for first,last,offset,length in read_records(self._filename(host, port, 'idx'), INDEX):
+            if (start is None or last >= start) and (end is None or first <= end):
+                blocks.append(offset)
+        if blocks:
+            with open(self._filename(host, port, 'blk'), 'rb') as f:
+                for offset in blocks:
+                    times,values = self._read_column(f, offset, metric)
+                    for t,value in zip(times, values):
+                        samples.setdefault(t, value)
+        return [(t, samples[t]) for t in sorted(samples)
+                if (start is None or t >= start) and (end is None or t <= end)]
+
+    def import_dat(self, lines):
+        """Import the samples of an xstat .dat file; return the number of
+        samples imported and the number of lines skipped.
+
+        The duration of each collection is stored as the metric 'duration',
+        gap markers as the metric 'gap', and rates as the metrics named
+        '<name>/s'. A port of '-', as in the gap markers written by earlier
+        versions of xstat.py, is taken to be the standard port 7000."""
+        imported = skipped = 0
+        key = None
+        samples = []
+        for line in lines:
+            fields = line.split()
+            try:
+                if len(fields) not in (5, 6, 7):
+                    raise ValueError(line)
+                t = number(fields[0])
+                host = fields[1]
+                port = 7000 if fields[2] == '-' else int(fields[2])
+                name = fields[3]
+                value = number(fields[4])
+                rate = None
+                if len(fields) == 7 and fields[6] != '-':
+                    rate = float(fields[6])
+            except ValueError:
+                skipped += 1
+                continue
+            if (host, port, t) != key:
+                if samples:
+                    self.append(key[0], key[1], samples)
+                    imported += len(samples)
+                key = (host, port, t)
+                samples = []
+                if len(fields) >= 6 and name != 'gap':
+                    samples.append((t, 'duration', float(fields[5])))
+            samples.append((t, name, value))
+            if rate is not None:
+                samples.append((t, name + '/s', rate))
+        if samples:
+            self.append(key[0], key[1], samples)
+            imported += len(samples)
+        return imported, skipped
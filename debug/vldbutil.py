@@ -25,15 +25,61 @@
 #
 # $ python3
 # >>> import vldbutil
-# >>> vldb = vldbutil.DB0('foo.DB0')
+# >>> vldb = vldbutil.VLDB0('foo.DB0')
 # >>> vldb.lookup_name('root.cell')
+# >>> vldb.lookup_id(536870915)
+#
+# For many lookups, use the in-memory index, which reads the database once:
+#
+# >>> index = vldb.index()
+# >>> index.lookup_name('root.cell')
+# >>> index.lookup_id(536870915)
+#
+# For computations over all the entries, use the columns of the database:
+#
+# >>> columns = vldb.columns()
+# >>> sum(1 for flags in columns.flags if flags & vldb.VLF_ROEXISTS)
+#
+# Commands:
+#
+# $ vldbutil.py demo foo.DB0      # print some example queries
+# $ vldbutil.py verify foo.DB0    # check the hash chains, free list and totals
+# $ vldbutil.py diff a.DB0 b.DB0  # compare the volumes and servers of two vldbs
+# $ vldbutil.py volumes foo.DB0 10.0.0.1 /vicepa   # volume sites on a server
+# $ vldbutil.py servers --unused foo.DB0          # servers without volumes
+# $ vldbutil.py report --json foo.DB0             # site distribution and load
+# $ vldbutil.py export --format csv --output foo.csv foo.DB0
+# $ vldbutil.py serve foo.DB0     # answer lookups over http, see VLDBService
+# $ vldbutil.py bench             # time the entry scan on a synthetic vldb
+#
+# The serve command answers GET requests for /name/<name>, /id/<volid>,
+# /volume/<name or volid>, /sites/<name or volid>, /server/<number, address or
+# uuid> and /version with json, e.g.:
+#
+# $ curl http://127.0.0.1:8047/name/root.cell
 
 import argparse
+import array
+import concurrent.futures
+import contextlib
+import csv
+import functools
+import http.server
+import json
+import socketserver
+import sqlite3
 import struct
+import threading
+import urllib.parse
 import sys
 import binascii
 import socket
 import collections
+import mmap
+import os
+import random
+import tempfile
+import time
 try:
     import hexdump
 except ImportError:
@@ -136,53 +182,46 @@ class VLHeader:
         return ret+">"
 
 class VLEntry:
-    # virtual fields, not on disk
-    address = None
-    offset = None
+    # Entries keep the raw 148-byte record and decode each field the first
+    # time it is used, so that whole databases can be held in memory.
+    __slots__ = (
+        # virtual fields, not on disk
+        'address', 'offset', 'raw',
 
-    # 4-byte ints
-    rwid = None
-    roid = None
-    bkid = None
-    flags = None
-    LockAfsId = None
-    LockTimestamp = None
-    cloneId = None
-    nextIdHashRW = None
-    nextIdHashRO = None
-    nextIdHashBK = None
-    nextNameHash = None
-
-    # fixed-size string, 65 bytes
-    name = None
-
-    # arrays of 1-byte ints, length 13
-    serverNumber = None
-    serverPartition = None
-    serverFlags = None
+        # 4-byte ints
+        'rwid', 'roid', 'bkid', 'flags', 'LockAfsId', 'LockTimestamp',
+        'cloneId', 'nextIdHashRW', 'nextIdHashRO', 'nextIdHashBK',
+        'nextNameHash',
+
+        # fixed-size string, 65 bytes
+        'name',
+
+        # arrays of 1-byte ints, length 13
+        'serverNumber', 'serverPartition', 'serverFlags',
+    )
 
     _s = struct.Struct('>11I65s13B13B13B')
+    _int = struct.Struct('>I')
 
     def __init__(self, buf, address):
         self.address = address
-        self.offset = address + VLDB0.DBASE_OFFSET
+        self.raw = buf
 
-        vals = self._s.unpack(buf)
-        self.rwid = vals[0]
-        self.roid = vals[1]
-        self.bkid = vals[2]
-        self.flags = vals[3]
-        self.LockAfsId = vals[4]
-        self.LockTimestamp = vals[5]
-        self.cloneId = vals[6]
-        self.nextIdHashRW = vals[7]
-        self.nextIdHashRO = vals[8]
-        self.nextIdHashBK = vals[9]
-        self.nextNameHash = vals[10]
-        self.name = vals[11].decode('ascii').rstrip('\x00')
-        self.serverNumber = vals[12:25]
-        self.serverPartition = vals[25:38]
-        self.serverFlags = vals[38:51]
+    def __getattr__(self, field):
+        # Only called for fields which have not been decoded yet.
+        if field == 'offset':
+            value = self.address + VLDB0.DBASE_OFFSET
+        elif field in self._ints:
+            value, = self._int.unpack_from(self.raw, self._ints[field])
+        elif field == 'name':
+            value = bytes(self.raw[44:109]).split(b'\x00', 1)[0].decode('ascii')
+        elif field in self._bytes:
+            start = self._bytes[field]
+            value = tuple(self.raw[start:start + 13])
+        else:
+            raise AttributeError(field)
+        setattr(self, field, value)
+        return value
 
     def sites(self):
         for i,sn in enumerate(self.serverNumber):
@@ -199,6 +238,74 @@ class VLEntry:
             ret += " %s: %u" % (field, getattr(self, field))
         return ret+">"
 
+VLEntry._ints = dict((field, i * 4) for i, field in enumerate(VLEntry.__slots__[3:14]))
+VLEntry._bytes = {'serverNumber': 109, 'serverPartition': 122, 'serverFlags': 135}
+
+class VLColumns:
+    """
+    Columns of all the entries of a VLDB0, including free entries, for
+    computations over the whole database.
+
+    Entry k is at address[k]. The rwid, roid, bkid, flags, LockTimestamp and
+    hash chain (nextIdHashRW, nextIdHashRO, nextIdHashBK, nextNameHash)
+    columns are arrays of ints. The names are packed into one bytes object,
+    the name of entry k being names[name_offsets[k]:name_offsets[k + 1]]. The
+    site columns are lists of 13 bytes objects, one per site slot, so the
+    server number of site i of entry k is serverNumber[i][k].
+    """
+    # The integer columns and their offsets in an entry.
+    _ints = (('rwid', 0), ('roid', 4), ('bkid', 8), ('flags', 12),
+             ('LockTimestamp', 20), ('nextIdHashRW', 28), ('nextIdHashRO', 32),
+             ('nextIdHashBK', 36), ('nextNameHash', 40))
+    _name = struct.Struct('>44x65s39x')
+
+    def __init__(self, vldb):
+        # Each column is unpacked on its own straight from the runs of
+        # entries, so no per-entry objects are kept while the columns are
+        # built.
+        data = memoryview(vldb.database())
+        size = VLEntry._s.size
+        runs = []
+        self.address = array.array('I')
+        for first, end in vldb.runs():
+            self.address.extend(range(first, end, size))
+            runs.append(data[first:end])
+        for field, offset in self._ints:
+            column = array.array('I')
+            unpack = struct.Struct('>%dxI%dx' % (offset, size - offset - 4))
+            for run in runs:
+                column.extend(value for value, in unpack.iter_unpack(run))
+            setattr(self, field, column)
+        names = bytearray()
+        self.name_offsets = array.array('I', [0])
+        for run in runs:
+            for name, in self._name.iter_unpack(run):
+                names += name.split(b'\x00', 1)[0]
+                self.name_offsets.append(len(names))
+        self.names = bytes(names)
+        self.serverNumber = self._sites(runs, 109)
+        self.serverPartition = self._sites(runs, 122)
+        self.serverFlags = self._sites(runs, 135)
+
+    @staticmethod
+    def _sites(runs, offset):
+        size = VLEntry._s.size
+        return [b''.join(bytes(run[offset + i::size]) for run in runs)
+                for i in range(13)]
+
+    def __len__(self):
+        return len(self.address)
+
+    def name(self, k):
+        return self.names[self.name_offsets[k]:self.name_offsets[k + 1]].decode('ascii')
+
+    def sites(self, k):
+        for i in range(13):
+            sn = self.serverNumber[i][k]
+            if sn != VLDB0.BADSERVERID:
+                yield Site(number=sn, partition=self.serverPartition[i][k],
+                           flags=self.serverFlags[i][k])
+
 class UUID:
     _s = struct.Struct('>I H H s s 6s')
     size = _s.size
@@ -315,6 +422,19 @@ class MHEntry:
             " unpacked_addrs={s.unpacked_addrs}"\
             ">".format(s=self)
 
+@functools.lru_cache(maxsize=1 << 17)
+def _hash_name(volname, hashsize):
+    # NameHash() of the VL server. Names are usually hashed many times (by
+    # lookups, verify and batches of names), so the hashes are memoized.
+    try:
+        chars = volname.encode('latin-1')
+    except UnicodeEncodeError:
+        raise TypeError("Non-ascii volume name '%s'" % volname)
+    ret = 0
+    for val in reversed(chars):
+        ret = (ret * 63 + (val - 63)) & 0xffffffff
+    return ret % hashsize
+
 class VLDB0:
     HASHSIZE = 8191
     DBASE_OFFSET = 64
@@ -326,23 +446,44 @@ class VLDB0:
     VLLOCKED    = 4
     VLCONTBLOCK = 8
 
+    # Volume types of an entry (entry flags).
+    VLF_RWEXISTS = 0x1000
+    VLF_ROEXISTS = 0x2000
+    VLF_BACKEXISTS = 0x4000
+
+    # Site flags.
+    VLSF_ROVOL = 0x2
+    VLSF_RWVOL = 0x4
+
+    # Size of an MH block, which replaces a run of entries in the database.
+    MHBLOCK_SIZE = 8192
+
+    # The flags word of an entry, or of an MH block header.
+    _flags = struct.Struct('>12xI132x')
+
     @classmethod
     def hash_name(cls, volname):
-        ret = 0
-        for c in reversed(volname):
-            val = ord(c)
-            if val > 255:
-                raise TypeError("Non-ascii char '%s'", val)
-            ret = (ret * 63 + (val - 63)) % (2**32)
-        ret = ret % cls.HASHSIZE
-        return ret
+        return _hash_name(volname, cls.HASHSIZE)
 
     @classmethod
     def hash_id(cls, volid):
         return volid % cls.HASHSIZE
 
-    def __init__(self, filename):
+    def __init__(self, filename, use_mmap=True):
+        self._index = None
+        self._columns = None
+        self._servers = None
+        self._server_numbers = None
+        self._mhdata = {}
+        self._database = None
+        self.map = None
         self.fh = open(filename, 'rb')
+        if use_mmap:
+            # Files which can not be mapped are read with seek and read.
+            try:
+                self.map = mmap.mmap(self.fh.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, OSError):
+                pass
         self.ubik_header = UbikHeader(fh=self.fh)
         self.vl_header = VLHeader(self.vlread(0, VLHeader._s.size))
         # MH block addresses are in the first MH block header.
@@ -351,9 +492,39 @@ class VLDB0:
         block = MHBlockHeader(buf, address)
         self.mhblocks = block.contaddr
 
+    def close(self):
+        # Release the views of the mapped database, the map and the file.
+        # The index refers back to this object, so it is dropped too rather
+        # than left for the cyclic garbage collector.
+        self._index = None
+        self._columns = None
+        if isinstance(self._database, memoryview):
+            self._database.release()
+        self._database = None
+        if self.map is not None:
+            try:
+                self.map.close()
+            except BufferError:
+                pass  # still exported; closed when the last view goes
+            self.map = None
+        self.fh.close()
+
     def vlread(self, address, size):
-        self.fh.seek(address + self.DBASE_OFFSET)
-        return self.fh.read(size)
+        # pread does not move the file position, so reads may be done from
+        # several threads at once.
+        return os.pread(self.fh.fileno(), size, address + self.DBASE_OFFSET)
+
+    def database(self):
+        # The whole database, indexed by address: the mapped file when it is
+        # mapped, otherwise a copy read into memory.
+        if self._database is None:
+            eof = self.vl_header.eofPtr
+            if self.map is not None:
+                view = memoryview(self.map)
+                self._database = view[self.DBASE_OFFSET:self.DBASE_OFFSET + eof]
+            else:
+                self._database = self.vlread(0, eof)
+        return self._database
 
     def vlreadentry(self, address):
         buf = self.vlread(address, VLEntry._s.size)
@@ -366,8 +537,12 @@ class VLDB0:
     def lookup_mh(self, block, index):
         assert(0 <= block <= 4)
         assert(1 <= index <= 63) # 0 is reserved for the header
-        address = self.mhblocks[block] + (index * MHEntry.size)
-        return self.mhreadentry(address)
+        # Each MH block is read once and kept.
+        if block not in self._mhdata:
+            self._mhdata[block] = self.vlread(self.mhblocks[block], self.MHBLOCK_SIZE)
+        start = index * MHEntry.size
+        buf = self._mhdata[block][start:start + MHEntry.size]
+        return MHEntry(buf, self.mhblocks[block] + start)
 
     def _server(self, number, addr):
         if addr:
@@ -383,13 +558,78 @@ class VLDB0:
             server = Server(number=number, uuid=None, addrs=[])
         return server
 
+    def servers(self):
+        # The server table, indexed by server number.
+        if self._servers is None:
+            self._servers = [self._server(i, addr)
+                             for i, addr in enumerate(self.vl_header.IpMappedAddr)]
+        return self._servers
+
     def walk_servers(self):
-        for i,addr in enumerate(self.vl_header.IpMappedAddr):
-            yield self._server(i, addr)
+        for server in self.servers():
+            yield server
 
     def lookup_server(self, number):
-        addr = self.vl_header.IpMappedAddr[number]
-        return self._server(number, addr)
+        return self.servers()[number]
+
+    @staticmethod
+    def _server_key(key):
+        # UUIDs are matched without dashes, so both the OpenAFS and the
+        # standard forms are found.
+        return str(key).replace('-', '').lower()
+
+    def server_number(self, key):
+        # Find the number of a server from one of its addresses or its UUID.
+        if self._server_numbers is None:
+            numbers = {}
+            for server in self.servers():
+                for addr in server.addrs:
+                    numbers.setdefault(addr, server.number)
+                if server.uuid:
+                    numbers[self._server_key(server.uuid)] = server.number
+            self._server_numbers = numbers
+        return self._server_numbers.get(self._server_key(key))
+
+    def site_counts(self):
+        # Count the sites of the volumes in use on each server number, from
+        # the site columns of the database.
+        columns = self.columns()
+        free = [k for k, flags in enumerate(columns.flags) if flags & self.VLFREE]
+        counts = collections.Counter()
+        for numbers in columns.serverNumber:
+            counts.update(numbers)
+            for k in free:
+                counts[numbers[k]] -= 1
+        del counts[self.BADSERVERID]
+        return counts
+
+    def volumes_on(self, number, partition=None):
+        # Yield the entry and the site of each site of the volumes in use on
+        # a server, and optionally a partition, in database order.
+        columns = self.columns()
+        found = []
+        target = bytes([number])
+        for i, numbers in enumerate(columns.serverNumber):
+            k = numbers.find(target)
+            while k != -1:
+                if not columns.flags[k] & self.VLFREE and \
+                   (partition is None or columns.serverPartition[i][k] == partition):
+                    found.append((k, i))
+                k = numbers.find(target, k + 1)
+        found.sort()
+        data = self.database()
+        size = VLEntry._s.size
+        for k, i in found:
+            address = columns.address[k]
+            entry = VLEntry(bytes(data[address:address + size]), address)
+            yield entry, Site(number=number, partition=columns.serverPartition[i][k],
+                              flags=columns.serverFlags[i][k])
+
+    def unused_servers(self):
+        # The servers in the server table with no sites of any volume.
+        counts = self.site_counts()
+        return [server for server in self.servers()
+                if (server.uuid or server.addrs) and not counts[server.number]]
 
     def _walk_hash(self, field_name, addr):
         while addr != 0:
@@ -406,11 +646,56 @@ class VLDB0:
         for entry in self._walk_hash('nextIdHashRW', addr):
             yield entry
 
+    def walk_roidhash(self, addr):
+        for entry in self._walk_hash('nextIdHashRO', addr):
+            yield entry
+
+    def walk_bkidhash(self, addr):
+        for entry in self._walk_hash('nextIdHashBK', addr):
+            yield entry
+
     def walk_freelist(self):
         for entry in self.walk_rwidhash(self.vl_header.freePtr):
             yield entry
 
+    def runs(self, start=None):
+        # Yield the address ranges (first, end) of the runs of entries between
+        # the MH blocks. An MH block is recognized by its flags word.
+        data = self.database()
+        size = VLEntry._s.size
+        iter_flags = self._flags.iter_unpack
+        first = start
+        if first is None:
+            first = self.vl_header.headersize
+        while first + size <= len(data):
+            end = first + (len(data) - first) // size * size
+            for n, (flags,) in enumerate(iter_flags(data[first:end])):
+                if flags == self.VLCONTBLOCK:
+                    end = first + n * size
+                    break
+            if first < end:
+                yield first, end
+            first = end + self.MHBLOCK_SIZE
+
+    def scan(self, start=None):
+        # Yield the address and the unpacked fields of each entry, including
+        # free entries. Each run of entries is unpacked with iter_unpack
+        # straight from the database.
+        data = self.database()
+        size = VLEntry._s.size
+        iter_unpack = VLEntry._s.iter_unpack
+        for first, end in self.runs(start):
+            for addr, vals in zip(range(first, end, size), iter_unpack(data[first:end])):
+                yield addr, vals
+
     def walk_entries(self, start=None):
+        if self.map is not None:
+            data = self.database()
+            size = VLEntry._s.size
+            for first, end in self.runs(start):
+                for addr in range(first, end, size):
+                    yield VLEntry(bytes(data[addr:addr + size]), addr)
+            return
         addr = start
         if addr is None:
             addr = self.vl_header.headersize
@@ -426,6 +711,11 @@ class VLDB0:
                 addr += 148
                 yield entry
 
+    def columns(self):
+        if self._columns is None:
+            self._columns = VLColumns(self)
+        return self._columns
+
     def lookup_name(self, volname):
         idx = self.hash_name(volname)
         addr = self.vl_header.VolnameHash[idx]
@@ -438,18 +728,973 @@ class VLDB0:
 
         return None
 
+    def lookup_names(self, volnames):
+        # Look up many names at once, returning a dict of each name to its
+        # entry, or None when it is not found. The names are grouped by hash
+        # bucket, and each chain is walked at most once, until all of its
+        # names are found. The index is used instead when it has been built.
+        volnames = set(volnames)
+        if self._index is not None and self._index._names is not None:
+            return dict((volname, self._index.lookup_name(volname)) for volname in volnames)
+        found = dict.fromkeys(volnames)
+        buckets = {}
+        for volname in volnames:
+            buckets.setdefault(self.hash_name(volname), set()).add(volname)
+        data = self.database()
+        size = VLEntry._s.size
+        unpack = VLEntry._int.unpack_from
+        for idx in sorted(buckets):
+            wanted = buckets[idx]
+            addr = self.vl_header.VolnameHash[idx]
+            visited = set()
+            while addr != 0 and wanted and addr not in visited:
+                visited.add(addr)
+                name = bytes(data[addr + 44:addr + 109]).split(b'\x00', 1)[0].decode('ascii')
+                if name in wanted:
+                    wanted.discard(name)
+                    found[name] = VLEntry(bytes(data[addr:addr + size]), addr)
+                addr, = unpack(data, addr + 40)
+        return found
+
+    def lookup_id(self, volid):
+        idx = self.hash_id(volid)
+        for entry in self.walk_rwidhash(self.vl_header.VolidHashRW[idx]):
+            if entry.rwid == volid:
+                return entry
+        for entry in self.walk_roidhash(self.vl_header.VolidHashRO[idx]):
+            if entry.roid == volid:
+                return entry
+        for entry in self.walk_bkidhash(self.vl_header.VolidHashBK[idx]):
+            if entry.bkid == volid:
+                return entry
+        return None
+
+    def index(self):
+        if self._index is None:
+            self._index = VLDB0Index(self)
+        return self._index
+
     def search_name(self, volname):
         addr = self.vl_header.headersize
         for entry in self.walk_entries():
             if entry.name == volname:
                 return entry
 
-def main(argv):
-    parser = argparse.ArgumentParser()
-    parser.add_argument('filename')
+class VLDB0Index:
+    """
+    In-memory name and volume id indexes of a VLDB0.
+
+    The database is mapped (or read) once, and each map is built from it the
+    first time it is used. The maps hold entry addresses; a VLEntry is only
+    decoded for the entry returned by a lookup.
+    """
+    def __init__(self, vldb):
+        self.vldb = vldb
+        self.data = vldb.database()
+        self._names = None
+        self._volids = None
+
+    def entry(self, address):
+        return VLEntry(bytes(self.data[address:address + VLEntry._s.size]), address)
+
+    @property
+    def names(self):
+        if self._names is None:
+            names = {}
+            for addr, vals in self.vldb.scan():
+                if not vals[3] & VLDB0.VLFREE:
+                    names[vals[11].split(b'\x00', 1)[0].decode('ascii')] = addr
+            self._names = names
+        return self._names
+
+    @property
+    def volids(self):
+        if self._volids is None:
+            volids = {}
+            for addr, vals in self.vldb.scan():
+                if not vals[3] & VLDB0.VLFREE:
+                    for volid in vals[0:3]:
+                        if volid:
+                            volids[volid] = addr
+            self._volids = volids
+        return self._volids
 
-    args = parser.parse_args(argv[1:])
+    def lookup_name(self, volname):
+        addr = self.names.get(volname)
+        if addr is None:
+            return None
+        return self.entry(addr)
+
+    def lookup_id(self, volid):
+        addr = self.volids.get(volid)
+        if addr is None:
+            return None
+        return self.entry(addr)
+
+class VLDB0Check:
+    """
+    Consistency checks of the hash chains, the free list and the header
+    totals of a VLDB0.
+
+    Each chain is followed once, marking the entries it reaches, so every
+    problem is found in a single pass over the database columns.
+    """
+    def __init__(self, vldb):
+        self.vldb = vldb
+        self.columns = vldb.columns()
+        self.position = dict((addr, k) for k, addr in enumerate(self.columns.address))
+        self.nlive = sum(1 for flags in self.columns.flags if not flags & VLDB0.VLFREE)
+        self.nfree = 0
+
+    def problems(self):
+        header = self.vldb.vl_header
+        columns = self.columns
+        names = [columns.name(k) for k in range(len(columns))]
+        for problem in self.check_hash('name', header.VolnameHash,
+                                       columns.nextNameHash, names,
+                                       self.vldb.hash_name):
+            yield problem
+        for kind, table, next_column, ids in (
+                ('RW', header.VolidHashRW, columns.nextIdHashRW, columns.rwid),
+                ('RO', header.VolidHashRO, columns.nextIdHashRO, columns.roid),
+                ('BK', header.VolidHashBK, columns.nextIdHashBK, columns.bkid)):
+            for problem in self.check_hash(kind + ' id', table, next_column,
+                                           ids, self.vldb.hash_id):
+                yield problem
+        for problem in self.check_freelist():
+            yield problem
+        for problem in self.check_totals():
+            yield problem
+
+    def where(self, k):
+        addr = self.columns.address[k]
+        return "entry at address %u (offset %u)" % (addr, addr + VLDB0.DBASE_OFFSET)
+
+    def check_hash(self, kind, table, next_column, keys, hash_key):
+        # Each entry with a key must be on the chain of the bucket of its key,
+        # exactly once. The bucket an entry was reached from is remembered so
+        # a loop can be told apart from an entry reached from two buckets.
+        flags = self.columns.flags
+        reached = array.array('H', bytes(2 * len(keys)))
+        for bucket, addr in enumerate(table):
+            previous = None
+            while addr != 0:
+                k = self.position.get(addr)
+                if k is None:
+                    if previous is None:
+                        yield "%s hash bucket %u: address %u is not an entry" % (
+                              kind, bucket, addr)
+                    else:
+                        yield "%s hash bucket %u: next address %u of %s is not an entry" % (
+                              kind, bucket, addr, self.where(previous))
+                    break
+                if reached[k] == bucket + 1:
+                    yield "%s hash bucket %u: loop at %s" % (kind, bucket, self.where(k))
+                    break
+                if reached[k]:
+                    yield "%s hash bucket %u: %s is also on bucket %u" % (
+                          kind, bucket, self.where(k), reached[k] - 1)
+                    break
+                reached[k] = bucket + 1
+                if flags[k] & VLDB0.VLFREE:
+                    yield "%s hash bucket %u: %s is free" % (kind, bucket, self.where(k))
+                elif not keys[k]:
+                    yield "%s hash bucket %u: %s has no %s" % (
+                          kind, bucket, self.where(k), kind)
+                elif hash_key(keys[k]) != bucket:
+                    yield "%s hash bucket %u: %s %s belongs in bucket %u" % (
+                          kind, bucket, self.where(k), keys[k], hash_key(keys[k]))
+                previous = k
+                addr = next_column[k]
+        for k, key in enumerate(keys):
+            if key and not reached[k] and not flags[k] & VLDB0.VLFREE:
+                yield "%s hash: %s %s is not on its chain (bucket %u)" % (
+                      kind, self.where(k), key, hash_key(key))
+
+    def check_freelist(self):
+        flags = self.columns.flags
+        reached = bytearray(len(flags))
+        previous = None
+        addr = self.vldb.vl_header.freePtr
+        while addr != 0:
+            k = self.position.get(addr)
+            if k is None:
+                if previous is None:
+                    yield "free list: address %u is not an entry" % addr
+                else:
+                    yield "free list: next address %u of %s is not an entry" % (
+                          addr, self.where(previous))
+                break
+            if reached[k]:
+                yield "free list: loop at %s" % self.where(k)
+                break
+            reached[k] = 1
+            self.nfree += 1
+            if not flags[k] & VLDB0.VLFREE:
+                yield "free list: %s is not marked free (flags 0x%x)" % (
+                      self.where(k), flags[k])
+            previous = k
+            addr = self.columns.nextIdHashRW[k]
+        for k, f in enumerate(flags):
+            if f & VLDB0.VLFREE and not reached[k]:
+                yield "free list: free %s is not on the free list" % self.where(k)
+
+    def check_totals(self):
+        header = self.vldb.vl_header
+        columns = self.columns
+        live = [not flags & VLDB0.VLFREE for flags in columns.flags]
+        for kind, ids, total in (('RW', columns.rwid, header.totalRW),
+                                 ('RO', columns.roid, header.totalRO),
+                                 ('BK', columns.bkid, header.totalBK)):
+            count = sum(1 for k, volid in enumerate(ids) if volid and live[k])
+            if count != total:
+                yield "header: total%s is %u, but %u entries have an %s id" % (
+                      kind, total, count, kind)
+        if header.allocs - header.frees != self.nlive:
+            yield "header: allocs - frees is %u - %u = %d, but %u entries are in use" % (
+                  header.allocs, header.frees, header.allocs - header.frees, self.nlive)
+
+def merge_join(a, b):
+    # Join two sorted sequences of keys, yielding the index of each key in a
+    # and in b, or None for a key which is only in one of them.
+    i = j = 0
+    while i < len(a) and j < len(b):
+        if a[i] < b[j]:
+            yield i, None
+            i += 1
+        elif a[i] > b[j]:
+            yield None, j
+            j += 1
+        else:
+            yield i, j
+            i += 1
+            j += 1
+    for i in range(i, len(a)):
+        yield i, None
+    for j in range(j, len(b)):
+        yield None, j
+
+class VLDB0Diff:
+    """
+    Structural differences between two VLDB0 databases.
+
+    Volume entries are matched by rwid and MH server entries by UUID. Each
+    side is reduced to a sorted array of keys, with the positions of the
+    entries, and the two are merge-joined; entries are only decoded when
+    their keys are in both databases.
+    """
+    HEADER_FIELDS = ('vldbversion', 'headersize', 'freePtr', 'eofPtr', 'allocs',
+                     'frees', 'MaxVolumeId', 'totalRW', 'totalRO', 'totalBK', 'SIT')
+    ENTRY_FIELDS = ('name', 'roid', 'bkid', 'flags', 'LockAfsId', 'LockTimestamp',
+                    'cloneId')
+
+    def __init__(self, a, b):
+        self.a = a
+        self.b = b
+
+    def differences(self):
+        for line in self.header_differences():
+            yield line
+        for line in self.entry_differences():
+            yield line
+        for line in self.server_differences():
+            yield line
+
+    def header_differences(self):
+        a, b = self.a.ubik_header, self.b.ubik_header
+        if (a.v_epoch, a.v_counter) != (b.v_epoch, b.v_counter):
+            yield "ubik version: %u.%u -> %u.%u" % (
+                  a.v_epoch, a.v_counter, b.v_epoch, b.v_counter)
+        a, b = self.a.vl_header, self.b.vl_header
+        for field in self.HEADER_FIELDS:
+            if getattr(a, field) != getattr(b, field):
+                yield "header %s: %u -> %u" % (field, getattr(a, field), getattr(b, field))
+        for number, (x, y) in enumerate(zip(a.IpMappedAddr, b.IpMappedAddr)):
+            if x != y:
+                yield "header IpMappedAddr[%u]: 0x%08x -> 0x%08x" % (number, x, y)
+
+    @staticmethod
+    def _volumes(vldb):
+        # Sorted rwids of the entries in use, and their addresses.
+        columns = vldb.columns()
+        keys = array.array('Q', sorted(
+            rwid << 32 | address
+            for rwid, address, flags in zip(columns.rwid, columns.address, columns.flags)
+            if not flags & VLDB0.VLFREE))
+        rwids = array.array('I', (key >> 32 for key in keys))
+        addrs = array.array('I', (key & 0xffffffff for key in keys))
+        return rwids, addrs
+
+    @staticmethod
+    def _entry(vldb, address):
+        data = vldb.database()
+        return VLEntry(bytes(data[address:address + VLEntry._s.size]), address)
+
+    def entry_differences(self):
+        a_ids, a_addrs = self._volumes(self.a)
+        b_ids, b_addrs = self._volumes(self.b)
+        a_data = memoryview(self.a.database())
+        b_data = memoryview(self.b.database())
+        size = VLEntry._s.size
+        for i, j in merge_join(a_ids, b_ids):
+            if j is None:
+                entry = self._entry(self.a, a_addrs[i])
+                yield "- volume %u '%s'" % (entry.rwid, entry.name)
+            elif i is None:
+                entry = self._entry(self.b, b_addrs[j])
+                yield "+ volume %u '%s'" % (entry.rwid, entry.name)
+            else:
+                # Skip the hash chain pointers, which only depend on where
+                # the entries happen to be.
+                x = a_data[a_addrs[i]:a_addrs[i] + size]
+                y = b_data[b_addrs[j]:b_addrs[j] + size]
+                if x[0:28] == y[0:28] and x[44:] == y[44:]:
+                    continue
+                x = self._entry(self.a, a_addrs[i])
+                y = self._entry(self.b, b_addrs[j])
+                changes = []
+                for field in self.ENTRY_FIELDS:
+                    if getattr(x, field) != getattr(y, field):
+                        if field == 'flags':
+                            change = "%s 0x%x -> 0x%x"
+                        else:
+                            change = "%s %r -> %r"
+                        changes.append(change % (field, getattr(x, field), getattr(y, field)))
+                if list(x.sites()) != list(y.sites()):
+                    changes.append("sites %s -> %s" % (
+                                   self._sites(x), self._sites(y)))
+                if not changes:
+                    # Only unused bytes differ: the name after its NUL, or
+                    # the site slots after the last site.
+                    continue
+                yield "~ volume %u '%s': %s" % (x.rwid, x.name, ", ".join(changes))
+
+    @staticmethod
+    def _sites(entry):
+        return "[%s]" % " ".join("%u/%u/0x%x" % site for site in entry.sites())
+
+    @staticmethod
+    def _servers(vldb):
+        # MH server entries by UUID, with the server number referring to each.
+        numbers = {}
+        for number, addr in enumerate(vldb.vl_header.IpMappedAddr):
+            if addr >> 24 == 0xff:
+                numbers[(addr >> 8) & 0xffff, addr & 0xff] = number
+        servers = {}
+        for block, address in enumerate(vldb.mhblocks):
+            if not address:
+                continue
+            for index in range(1, 64):
+                mh = vldb.mhreadentry(address + index * MHEntry.size)
+                if not any(mh.raw):
+                    continue
+                servers[str(mh.uuid)] = (numbers.get((block, index)), mh.uniquifier,
+                                         mh.addrs)
+        return servers
+
+    def server_differences(self):
+        a = self._servers(self.a)
+        b = self._servers(self.b)
+        a_uuids = sorted(a)
+        b_uuids = sorted(b)
+        for i, j in merge_join(a_uuids, b_uuids):
+            if j is None:
+                yield "- server %s %s" % (a_uuids[i], a[a_uuids[i]][2])
+            elif i is None:
+                yield "+ server %s %s" % (b_uuids[j], b[b_uuids[j]][2])
+            elif a[a_uuids[i]] != b[b_uuids[j]]:
+                changes = []
+                for field, x, y in zip(('number', 'uniquifier', 'addrs'),
+                                       a[a_uuids[i]], b[b_uuids[j]]):
+                    if x != y:
+                        changes.append("%s %s -> %s" % (field, x, y))
+                yield "~ server %s: %s" % (a_uuids[i], ", ".join(changes))
+
+def partition_name(number):
+    # The /vicep name of a partition number.
+    if number < 26:
+        return '/vicep' + chr(ord('a') + number)
+    number -= 26
+    return '/vicep' + chr(ord('a') + number // 26) + chr(ord('a') + number % 26)
+
+def partition_number(name):
+    # The partition number of a /vicep name, or of its suffix.
+    if name.isdigit():
+        return int(name)
+    if name.startswith('/vicep'):
+        name = name[len('/vicep'):]
+    if len(name) == 1 and 'a' <= name <= 'z':
+        return ord(name) - ord('a')
+    if len(name) == 2 and 'a' <= name[0] <= 'z' and 'a' <= name[1] <= 'z':
+        return 26 + (ord(name[0]) - ord('a')) * 26 + ord(name[1]) - ord('a')
+    raise ValueError("Not a partition: %s" % name)
+
+class VLDB0Export:
+    """
+    Stream the volume entries of a VLDB0 as JSON-lines, CSV or SQLite.
+
+    The entries are unpacked straight from the scan of the database and each
+    one is written out before the next is read, so memory use does not grow
+    with the size of the database. The server of each site is resolved
+    through the server table, which is read once.
+    """
+    FIELDS = ('name', 'rwid', 'roid', 'bkid', 'flags', 'LockAfsId',
+              'LockTimestamp', 'cloneId')
+    SITE_FIELDS = ('server', 'uuid', 'addrs', 'partition', 'siteFlags')
+    BATCH_SIZE = 10000
+
+    def __init__(self, vldb):
+        self.vldb = vldb
+        self.servers = {}
+        for server in vldb.servers():
+            uuid = str(server.uuid) if server.uuid else None
+            self.servers[server.number] = (uuid, server.addrs)
+
+    def volumes(self):
+        # Yield a tuple of the FIELDS of each volume in use, and a list of
+        # tuples of the SITE_FIELDS of its sites.
+        servers = self.servers
+        for addr, vals in self.vldb.scan():
+            if vals[3] & VLDB0.VLFREE:
+                continue
+            name = vals[11].split(b'\x00', 1)[0].decode('ascii')
+            volume = (name,) + vals[0:7]
+            sites = []
+            for i in range(13):
+                number = vals[12 + i]
+                if number != VLDB0.BADSERVERID:
+                    uuid, addrs = servers.get(number, (None, []))
+                    sites.append((number, uuid, addrs,
+                                  partition_name(vals[25 + i]), vals[38 + i]))
+            yield volume, sites
+
+    def write_jsonl(self, f):
+        count = 0
+        for volume, sites in self.volumes():
+            record = dict(zip(self.FIELDS, volume))
+            record['sites'] = [dict(zip(self.SITE_FIELDS, site)) for site in sites]
+            f.write(json.dumps(record))
+            f.write('\n')
+            count += 1
+        return count
+
+    def write_csv(self, f):
+        # One row per site; a volume without sites has a single row with
+        # empty site fields.
+        writer = csv.writer(f)
+        writer.writerow(self.FIELDS + self.SITE_FIELDS)
+        empty = (None,) * len(self.SITE_FIELDS)
+        count = 0
+        for volume, sites in self.volumes():
+            if not sites:
+                writer.writerow(volume + empty)
+            for number, uuid, addrs, partition, flags in sites:
+                writer.writerow(volume + (number, uuid, ' '.join(addrs), partition, flags))
+            count += 1
+        return count
+
+    def write_sqlite(self, filename):
+        # A volumes table, and a sites table keyed by the rwid of the volume.
+        # Rows are inserted in batches within a single transaction.
+        db = sqlite3.connect(filename)
+        try:
+            db.execute('DROP TABLE IF EXISTS volumes')
+            db.execute('DROP TABLE IF EXISTS sites')
+            db.execute('CREATE TABLE volumes (%s)' % ', '.join(
+                       '%s %s' % (field, 'TEXT' if field == 'name' else 'INTEGER')
+                       for field in self.FIELDS))
+            db.execute('CREATE TABLE sites (rwid INTEGER, server INTEGER, uuid TEXT, '
+                       'addrs TEXT, partition TEXT, siteFlags INTEGER)')
+            insert_volumes = 'INSERT INTO volumes VALUES (%s)' % ', '.join('?' * len(self.FIELDS))
+            insert_sites = 'INSERT INTO sites VALUES (?, ?, ?, ?, ?, ?)'
+            count = 0
+            volumes = []
+            sites = []
+            for volume, volume_sites in self.volumes():
+                volumes.append(volume)
+                for number, uuid, addrs, partition, flags in volume_sites:
+                    sites.append((volume[1], number, uuid, ' '.join(addrs), partition, flags))
+                if len(volumes) == self.BATCH_SIZE:
+                    db.executemany(insert_volumes, volumes)
+                    db.executemany(insert_sites, sites)
+                    count += len(volumes)
+                    volumes = []
+                    sites = []
+            db.executemany(insert_volumes, volumes)
+            db.executemany(insert_sites, sites)
+            count += len(volumes)
+            db.execute('CREATE INDEX volumes_name ON volumes (name)')
+            db.execute('CREATE INDEX volumes_rwid ON volumes (rwid)')
+            db.execute('CREATE INDEX sites_rwid ON sites (rwid)')
+            db.commit()
+        finally:
+            db.close()
+        return count
+
+    def write(self, fmt, filename=None):
+        # Write to the file, or to stdout when no file name is given (except
+        # for sqlite). Returns the number of volumes written.
+        if fmt == 'sqlite':
+            return self.write_sqlite(filename)
+        write = getattr(self, 'write_' + fmt)
+        if filename is None:
+            return write(sys.stdout)
+        with open(filename, 'w', newline='') as f:
+            return write(f)
+
+class VLDB0Report:
+    """
+    Site distribution and server load of a VLDB0, computed from the site
+    columns of the database.
+
+    Each site slot column is counted as a whole, together with a column
+    telling live entries with and without a BK volume from free entries, so
+    the work done per entry in Python is limited to the volumes with several
+    RO sites and to the locked entries.
+    """
+    LOCK_AGES = ((3600, '<1h'), (86400, '<1d'), (7 * 86400, '<1w'), (None, '>=1w'))
+
+    def __init__(self, vldb, now=None, limit=10):
+        self.vldb = vldb
+        self.now = int(time.time()) if now is None else now
+        self.limit = limit
+
+    def compute(self):
+        vldb = self.vldb
+        columns = vldb.columns()
+        n = len(columns)
+        # 0: live entry, 1: live entry with a BK volume, 2: free entry.
+        kinds = bytes(2 if flags & VLDB0.VLFREE else
+                      1 if flags & VLDB0.VLF_BACKEXISTS else 0
+                      for flags in columns.flags)
+
+        sites = collections.Counter()
+        ro_count = 0
+        for i in range(13):
+            sites.update(zip(columns.serverNumber[i], columns.serverPartition[i],
+                             columns.serverFlags[i], kinds))
+            # The number of RO sites of each entry, summed as big integers of
+            # one byte per entry (13 sites can not carry into the next byte).
+            is_ro = columns.serverFlags[i].translate(_RO_SITE)
+            ro_count += int.from_bytes(is_ro, 'big')
+        ro_sites = ro_count.to_bytes(n, 'big')
+
+        servers = {}
+        partitions = {}
+        for (number, partition, flags, kind), count in sites.items():
+            if number == VLDB0.BADSERVERID or kind == 2:
+                continue
+            for table, key in ((servers, number), (partitions, (number, partition))):
+                load = table.setdefault(key, {'rw': 0, 'ro': 0, 'bk': 0})
+                if flags & VLDB0.VLSF_RWVOL:
+                    load['rw'] += count
+                    if kind == 1:
+                        load['bk'] += count
+                if flags & VLDB0.VLSF_ROVOL:
+                    load['ro'] += count
+
+        replicas = collections.Counter(
+            count for count, kind, flags in zip(ro_sites, kinds, columns.flags)
+            if kind != 2 and (count or flags & VLDB0.VLF_ROEXISTS))
+
+        # Volumes with several RO sites which still lose all of them with a
+        # single server. Volumes with one RO site are in the replica counts.
+        one_server = []
+        for k, count in enumerate(ro_sites):
+            if count < 2 or kinds[k] == 2:
+                continue
+            numbers = set(columns.serverNumber[i][k] for i in range(13)
+                          if columns.serverFlags[i][k] & VLDB0.VLSF_ROVOL)
+            if len(numbers) == 1:
+                one_server.append(k)
+
+        locked = [k for k, flags in enumerate(columns.flags)
+                  if flags & VLDB0.VLLOCKED and not flags & VLDB0.VLFREE]
+        ages = collections.OrderedDict((label, 0) for _, label in self.LOCK_AGES)
+        for k in locked:
+            age = self.now - columns.LockTimestamp[k]
+            for limit, label in self.LOCK_AGES:
+                if limit is None or age < limit:
+                    ages[label] += 1
+                    break
+        locked.sort(key=columns.LockTimestamp.__getitem__)
+
+        table = vldb.servers()
+        return collections.OrderedDict((
+            ('servers', [collections.OrderedDict(
+                [('server', number),
+                 ('uuid', str(table[number].uuid) if table[number].uuid else None),
+                 ('addrs', table[number].addrs)] + sorted(servers[number].items(), reverse=True))
+                for number in sorted(servers)]),
+            ('partitions', [collections.OrderedDict(
+                [('server', number), ('partition', partition_name(partition))] +
+                sorted(partitions[number, partition].items(), reverse=True))
+                for number, partition in sorted(partitions)]),
+            ('ro_replicas', collections.OrderedDict(
+                (str(count), replicas[count]) for count in sorted(replicas))),
+            ('ro_one_server', collections.OrderedDict((
+                ('count', len(one_server)),
+                ('volumes', [columns.name(k) for k in one_server[:self.limit]])))),
+            ('locked', collections.OrderedDict((
+                ('count', len(locked)),
+                ('ages', ages),
+                ('oldest', [collections.OrderedDict((
+                    ('name', columns.name(k)),
+                    ('rwid', columns.rwid[k]),
+                    ('LockTimestamp', columns.LockTimestamp[k]),
+                    ('age', self.now - columns.LockTimestamp[k])))
+                    for k in locked[:self.limit]])))),
+        ))
+
+    @staticmethod
+    def format_table(report):
+        lines = ["servers:", "%6s %8s %8s %8s  %s" % ('server', 'rw', 'ro', 'bk', 'addrs')]
+        for row in report['servers']:
+            lines.append("%6u %8u %8u %8u  %s" % (
+                         row['server'], row['rw'], row['ro'], row['bk'], ' '.join(row['addrs'])))
+        lines += ["", "partitions:",
+                  "%6s %-9s %8s %8s %8s" % ('server', 'partition', 'rw', 'ro', 'bk')]
+        for row in report['partitions']:
+            lines.append("%6u %-9s %8u %8u %8u" % (
+                         row['server'], row['partition'], row['rw'], row['ro'], row['bk']))
+        lines += ["", "RO sites per volume:"]
+        for count, volumes in report['ro_replicas'].items():
+            lines.append("%6s %8u" % (count, volumes))
+        lines += ["", "volumes with several RO sites, all on one server: %u" %
+                  report['ro_one_server']['count']]
+        lines += ["  %s" % name for name in report['ro_one_server']['volumes']]
+        locked = report['locked']
+        lines += ["", "locked entries: %u" % locked['count']]
+        lines += ["%6s %8u" % (label, count) for label, count in locked['ages'].items()]
+        lines += ["  %s %u locked %s (%u s ago)" % (
+                  row['name'], row['rwid'],
+                  time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(row['LockTimestamp'])),
+                  row['age']) for row in locked['oldest']]
+        return '\n'.join(lines)
+
+# Translation table of site flags to 1 for an RO site, 0 otherwise.
+_RO_SITE = bytes(1 if flags & VLDB0.VLSF_ROVOL else 0 for flags in range(256))
+
+class VLDBSnapshot:
+    """
+    A VLDB0 at one ubik version, with its lookup indexes built.
+    """
+    def __init__(self, filename):
+        self.vldb = VLDB0(filename)
+        self.version = (self.vldb.ubik_header.v_epoch, self.vldb.ubik_header.v_counter)
+        index = self.vldb.index()
+        self.names = index.names
+        self.volids = index.volids
+        self.servers = self.vldb.servers()
+        self.server_number = self.vldb.server_number
+        self.server_number('')  # build the reverse index now
+        self.users = 0  # queries in flight, counted by VLDBService
+
+    def close(self):
+        self.vldb.close()
+
+class VLDBService:
+    """
+    Answer lookups from a snapshot of a VLDB0 kept in memory.
+
+    A watcher thread reads the ubik header of the file every interval, and
+    when the version changes it builds a new snapshot in the background and
+    then replaces the current one. Each query uses the snapshot current when
+    it starts, and reads entries with pread, so queries may run concurrently
+    from many threads. A replaced snapshot is closed once the last query
+    using it finishes.
+    """
+    def __init__(self, filename, interval=1.0):
+        self.filename = filename
+        self.interval = interval
+        self.snapshot = VLDBSnapshot(filename)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watcher = threading.Thread(target=self._watch, name='vldb-watcher')
+        self._watcher.daemon = True
+
+    def start(self):
+        self._watcher.start()
+
+    def stop(self):
+        self._stop.set()
+        self._watcher.join()
+
+    def version(self):
+        # The ubik version of the file on disk, which may have been replaced.
+        with open(self.filename, 'rb') as f:
+            header = UbikHeader(buf=os.pread(f.fileno(), UbikHeader._s.size, 0))
+        return (header.v_epoch, header.v_counter)
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            try:
+                if self.version() != self.snapshot.version:
+                    snapshot = VLDBSnapshot(self.filename)
+                    with self._lock:
+                        old, self.snapshot = self.snapshot, snapshot
+                        idle = old.users == 0
+                    if idle:
+                        old.close()
+                    print("vldbutil.py: serve: loaded version %u.%u" % snapshot.version,
+                          file=sys.stderr)
+            except Exception as e:
+                # The file may be in the middle of being written; try again
+                # at the next interval.
+                print("vldbutil.py: serve: reload failed: %s" % e, file=sys.stderr)
+
+    @contextlib.contextmanager
+    def _current(self):
+        # Use the current snapshot for a query. The last query using a
+        # snapshot which has since been replaced closes it.
+        with self._lock:
+            snapshot = self.snapshot
+            snapshot.users += 1
+        try:
+            yield snapshot
+        finally:
+            with self._lock:
+                snapshot.users -= 1
+                retired = snapshot.users == 0 and snapshot is not self.snapshot
+            if retired:
+                snapshot.close()
+
+    def _entry(self, snapshot, address, match):
+        # Read the entry, and check it is still the one the index refers to,
+        # in case the file was rewritten in place.
+        if address is None:
+            return None
+        entry = snapshot.vldb.vlreadentry(address)
+        if entry.flags & VLDB0.VLFREE or not match(entry):
+            return None
+        return entry
+
+    def _record(self, snapshot, entry):
+        record = dict((field, getattr(entry, field)) for field in VLDB0Export.FIELDS)
+        sites = []
+        for site in entry.sites():
+            server = snapshot.servers[site.number]
+            sites.append(dict(zip(VLDB0Export.SITE_FIELDS, (
+                site.number, str(server.uuid) if server.uuid else None, server.addrs,
+                partition_name(site.partition), site.flags))))
+        record['sites'] = sites
+        return record
 
+    def lookup_name(self, volname):
+        with self._current() as snapshot:
+            entry = self._entry(snapshot, snapshot.names.get(volname),
+                                lambda entry: entry.name == volname)
+            return entry and self._record(snapshot, entry)
+
+    def lookup_id(self, volid):
+        with self._current() as snapshot:
+            entry = self._entry(snapshot, snapshot.volids.get(volid),
+                                lambda entry: volid in (entry.rwid, entry.roid, entry.bkid))
+            return entry and self._record(snapshot, entry)
+
+    def lookup_volume(self, key):
+        if key.isdigit():
+            return self.lookup_id(int(key))
+        return self.lookup_name(key)
+
+    def lookup_sites(self, key):
+        record = self.lookup_volume(key)
+        return record and record['sites']
+
+    def lookup_server(self, key):
+        with self._current() as snapshot:
+            if key.isdigit():
+                number = int(key)
+            else:
+                number = snapshot.server_number(key)
+            servers = snapshot.servers
+        if number is None or number >= len(servers):
+            return None
+        server = servers[number]
+        if not (server.uuid or server.addrs):
+            return None
+        return {'server': number, 'uuid': str(server.uuid) if server.uuid else None,
+                'addrs': server.addrs}
+
+    def query(self, path):
+        # Answer a request path: /name/<name>, /id/<volid>, /volume/<name or
+        # id>, /sites/<name or id>, /server/<number, address or uuid> or
+        # /version. Returns the http status and the result.
+        parts = [urllib.parse.unquote(part) for part in path.strip('/').split('/')]
+        if parts == ['version']:
+            return 200, {'version': '%u.%u' % self.snapshot.version}
+        if len(parts) != 2:
+            return 400, {'error': 'bad request'}
+        kind, key = parts
+        if kind == 'name':
+            result = self.lookup_name(key)
+        elif kind == 'id' and key.isdigit():
+            result = self.lookup_id(int(key))
+        elif kind == 'volume':
+            result = self.lookup_volume(key)
+        elif kind == 'sites':
+            result = self.lookup_sites(key)
+        elif kind == 'server':
+            result = self.lookup_server(key)
+        else:
+            return 400, {'error': 'bad request'}
+        if result is None:
+            return 404, {'error': 'not found'}
+        return 200, result
+
+class VLDBRequestHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        status, result = self.server.service.query(urllib.parse.urlsplit(self.path).path)
+        body = json.dumps(result).encode('utf-8') + b'\n'
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix socket clients have no address.
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return 'local'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            http.server.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+class _ThreadPoolMixIn:
+    # Handle each request on a bounded pool of threads.
+    def process_request(self, request, client_address):
+        self.pool.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+class VLDBHTTPServer(_ThreadPoolMixIn, http.server.HTTPServer):
+    pass
+
+class VLDBUnixServer(_ThreadPoolMixIn, socketserver.UnixStreamServer):
+    pass
+
+def make_vldb(filename, volumes, servers=20, seed=1):
+    """
+    Write a synthetic, consistent vldb version 4 database for testing and
+    benchmarks. One in a hundred entries is free, some volumes have RO and BK
+    volumes and RO sites, some entries are locked, and a second MH block is
+    placed in the middle of the entries.
+    """
+    rnd = random.Random(seed)
+    size = VLEntry._s.size
+    nfree = volumes // 100
+    nentries = volumes + nfree
+    headersize = VLHeader._s.size
+    now = int(time.time())
+
+    # Allocate the MH blocks and the entries.
+    mhblocks = [headersize]
+    addrs = []
+    addr = headersize + VLDB0.MHBLOCK_SIZE
+    for i in range(nentries):
+        if i == nentries // 2:
+            mhblocks.append(addr)
+            addr += VLDB0.MHBLOCK_SIZE
+        addrs.append(addr)
+        addr += size
+    eof = addr
+
+    names = ['root.afs', 'root.cell']
+    free = set(rnd.sample(range(nentries), nfree))
+    name_hash = [0] * VLDB0.HASHSIZE
+    id_hash = [[0] * VLDB0.HASHSIZE for _ in range(3)]
+    totals = [0, 0, 0]
+    entries = []
+    freeptr = 0
+    volid = 536870912
+    for i, addr in enumerate(addrs):
+        if i in free:
+            # Free entries are cleared, apart from the flags and free list.
+            sites = [[0] * 13, [0] * 13, [0] * 13]
+            entries.append([0, 0, 0, VLDB0.VLFREE, 0, 0, 0, freeptr, 0, 0, 0,
+                            b''] + sites)
+            freeptr = addr
+            continue
+        sites = [[VLDB0.BADSERVERID] * 13, [0] * 13, [0] * 13]
+        if names:
+            name = names.pop(0)
+        else:
+            name = 'vol.%d' % i
+        ids = [volid, 0, 0]
+        flags = VLDB0.VLF_RWEXISTS
+        if rnd.random() < 0.3:
+            ids[1] = volid + 1
+            flags |= VLDB0.VLF_ROEXISTS
+        if rnd.random() < 0.8:
+            ids[2] = volid + 2
+            flags |= VLDB0.VLF_BACKEXISTS
+        volid += 3
+        lock = 0
+        if rnd.random() < 0.01:
+            flags |= VLDB0.VLLOCKED
+            lock = now - rnd.randint(0, 30 * 86400)
+        sites[0][0] = rnd.randrange(servers)
+        sites[1][0] = rnd.randrange(4)
+        sites[2][0] = VLDB0.VLSF_RWVOL
+        if ids[1]:
+            replicas = rnd.sample(range(servers), rnd.randint(1, min(3, servers)))
+            for n, server in enumerate(replicas, 1):
+                sites[0][n] = server
+                sites[1][n] = rnd.randrange(4)
+                sites[2][n] = VLDB0.VLSF_ROVOL
+        nexts = [0, 0, 0]
+        for t, v in enumerate(ids):
+            if v:
+                totals[t] += 1
+                nexts[t] = id_hash[t][VLDB0.hash_id(v)]
+                id_hash[t][VLDB0.hash_id(v)] = addr
+        h = VLDB0.hash_name(name)
+        entries.append(ids + [flags, 0, lock, 0] + nexts +
+                       [name_hash[h], name.encode('ascii')] + sites)
+        name_hash[h] = addr
+
+    ipmapped = [0] * 255
+    for number in range(servers):
+        block, index = divmod(number, 63)
+        ipmapped[number] = 0xff000000 | (block << 8) | (index + 1)
+
+    def mhblock(block):
+        buf = bytearray(VLDB0.MHBLOCK_SIZE)
+        contaddrs = mhblocks + [0] * (4 - len(mhblocks))
+        struct.pack_into('>I8xI4I', buf, 0, 0, VLDB0.VLCONTBLOCK, *contaddrs)
+        for index in range(1, 64):
+            number = block * 63 + index - 1
+            if number >= servers:
+                break
+            node = struct.pack('>HI', 0x0016, number)
+            address = (10 << 24) | (number + 1)
+            struct.pack_into('>IHHcc6sII', buf, index * MHEntry.size,
+                             0x11223344, 0x5566, 0x7788, b'\x99', b'\xaa',
+                             node, 1, address)
+        return buf
+
+    with open(filename, 'wb') as f:
+        f.write(UbikHeader._s.pack(0x354545, 0, VLDB0.DBASE_OFFSET, now, 1))
+        f.write(bytes(VLDB0.DBASE_OFFSET - UbikHeader._s.size))
+        f.write(VLHeader._s.pack(4, headersize, freeptr, eof, nentries, nfree,
+                                 volid - 1, totals[0], totals[1], totals[2],
+                                 *(ipmapped + name_hash + id_hash[0] +
+                                   id_hash[1] + id_hash[2] + [mhblocks[0]])))
+        f.write(mhblock(0))
+        for i, entry in enumerate(entries):
+            if i == nentries // 2:
+                f.write(mhblock(1))
+            f.write(VLEntry._s.pack(*entry[0:12] + entry[12] + entry[13] + entry[14]))
+
+def demo(args):
     # Example usage of some simple functionality:
 
     vldb = VLDB0(args.filename)
@@ -484,5 +1729,252 @@ def main(argv):
         if server.uuid or server.addrs:
             print(server.number, count.get(server.number,0), server.uuid, server.addrs)
 
+def diff(args):
+    differences = 0
+    for line in VLDB0Diff(VLDB0(args.a), VLDB0(args.b)).differences():
+        print(line)
+        differences += 1
+    return 1 if differences else 0
+
+def verify(args):
+    vldb = VLDB0(args.filename)
+    check = VLDB0Check(vldb)
+    count = 0
+    for problem in check.problems():
+        print(problem)
+        count += 1
+    print("%u entries in use, %u free entries, %u problems" % (
+          check.nlive, check.nfree, count))
+    return 1 if count else 0
+
+def parse_server(vldb, key):
+    if key.isdigit():
+        return int(key)
+    number = vldb.server_number(key)
+    if number is None:
+        raise ValueError("Server not found: %s" % key)
+    return number
+
+def volumes(args):
+    vldb = VLDB0(args.filename)
+    try:
+        number = parse_server(vldb, args.server)
+        partition = None
+        if args.partition is not None:
+            partition = partition_number(args.partition)
+    except ValueError as e:
+        print("vldbutil.py: volumes: %s" % e, file=sys.stderr)
+        return 2
+    for entry, site in vldb.volumes_on(number, partition):
+        print(entry.rwid, entry.name, partition_name(site.partition), "0x%x" % site.flags)
+    return 0
+
+def servers(args):
+    vldb = VLDB0(args.filename)
+    if args.unused:
+        table = vldb.unused_servers()
+    else:
+        table = [server for server in vldb.servers() if server.uuid or server.addrs]
+    counts = vldb.site_counts()
+    for server in table:
+        print(server.number, counts[server.number], server.uuid, ' '.join(server.addrs))
+    return 0
+
+def serve(args):
+    service = VLDBService(args.filename, args.interval)
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+        server = VLDBUnixServer(args.socket, VLDBRequestHandler)
+        where = args.socket
+    else:
+        server = VLDBHTTPServer((args.address, args.port), VLDBRequestHandler)
+        where = 'http://%s:%u/' % server.server_address[:2]
+    server.service = service
+    server.verbose = args.verbose
+    server.pool = concurrent.futures.ThreadPoolExecutor(args.threads)
+    service.start()
+    print("vldbutil.py: serve: version %u.%u on %s" % (service.snapshot.version + (where,)),
+          file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.pool.shutdown()
+        service.stop()
+        if args.socket:
+            os.unlink(args.socket)
+    return 0
+
+def report(args):
+    result = VLDB0Report(VLDB0(args.filename), args.now, args.limit).compute()
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(VLDB0Report.format_table(result))
+    return 0
+
+def export(args):
+    if args.format == 'sqlite' and args.output is None:
+        print("vldbutil.py: export: an --output file is required for sqlite",
+              file=sys.stderr)
+        return 2
+    VLDB0Export(VLDB0(args.filename)).write(args.format, args.output)
+    return 0
+
+def bench(args):
+    # Time the entry scan of a synthetic database, reading entries one at a
+    # time and from the mapped database, then time name lookups and the
+    # exports.
+    filename = args.filename
+    if filename is None:
+        fd, filename = tempfile.mkstemp(suffix='.DB0')
+        os.close(fd)
+    try:
+        start = time.time()
+        make_vldb(filename, args.volumes, args.servers)
+        print("generated %d volumes in %.2f s (%d bytes)" % (
+              args.volumes, time.time() - start, os.path.getsize(filename)))
+
+        def entries(vldb):
+            return vldb.walk_entries()
+
+        def values(vldb):
+            return vldb.scan()
+
+        def columns(vldb):
+            return vldb.columns().address
+
+        for name, use_mmap, walk in (('read', False, entries),
+                                     ('mmap', True, entries),
+                                     ('mmap values', True, values),
+                                     ('columns', True, columns)):
+            vldb = VLDB0(filename, use_mmap=use_mmap)
+            start = time.time()
+            count = 0
+            for _ in walk(vldb):
+                count += 1
+            elapsed = time.time() - start
+            print("%-13s %9d entries %7.2f s %10.0f entries/s" % (
+                  name, count, elapsed, count / elapsed))
+
+        # Look up a sample of the names, with some which are not found.
+        vldb = VLDB0(filename)
+        rnd = random.Random(1)
+        names = ['vol.%d' % rnd.randrange(args.volumes * 2) for _ in range(args.lookups)]
+        start = time.time()
+        for name in names:
+            vldb.lookup_name(name)
+        elapsed = time.time() - start
+        print("%-13s %9d names   %7.2f s %10.0f names/s" % (
+              'lookup_name', len(names), elapsed, len(names) / elapsed))
+        for name, vldb in (('lookup_names', VLDB0(filename)),
+                           ('index', VLDB0(filename))):
+            if name == 'index':
+                vldb.index().names
+            start = time.time()
+            vldb.lookup_names(names)
+            elapsed = time.time() - start
+            print("%-13s %9d names   %7.2f s %10.0f names/s" % (
+                  name, len(names), elapsed, len(names) / elapsed))
+
+        output = tempfile.mkdtemp()
+        try:
+            for fmt in ('jsonl', 'csv', 'sqlite'):
+                exporter = VLDB0Export(VLDB0(filename))
+                start = time.time()
+                count = exporter.write(fmt, os.path.join(output, 'export.' + fmt))
+                elapsed = time.time() - start
+                print("%-13s %9d entries %7.2f s %10.0f entries/s" % (
+                      'export ' + fmt, count, elapsed, count / elapsed))
+        finally:
+            for name in os.listdir(output):
+                os.unlink(os.path.join(output, name))
+            os.rmdir(output)
+    finally:
+        if args.filename is None:
+            os.unlink(filename)
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    p = commands.add_parser('demo', help='print some example queries')
+    p.add_argument('filename')
+    p = commands.add_parser('verify', help='check the hash chains, free list and totals')
+    p.add_argument('filename')
+    p = commands.add_parser('diff', help='compare the headers, volumes and servers of two vldbs')
+    p.add_argument('a')
+    p.add_argument('b')
+    p = commands.add_parser('volumes', help='list the volume sites on a server')
+    p.add_argument('filename')
+    p.add_argument('server', help='server number, address or uuid')
+    p.add_argument('partition', nargs='?', help='partition name or number')
+    p = commands.add_parser('servers', help='list the servers and their number of sites')
+    p.add_argument('filename')
+    p.add_argument('--unused', action='store_true', help='only servers without sites')
+    p = commands.add_parser('report', help='report the site distribution and server load')
+    p.add_argument('filename')
+    p.add_argument('--json', action='store_true', help='print the report as json')
+    p.add_argument('--limit', type=int, default=10,
+                   help='number of volumes to list (default: %(default)s)')
+    p.add_argument('--now', type=int,
+                   help='time to compute lock ages from (default: the current time)')
+    p = commands.add_parser('export', help='write the volumes as json-lines, csv or sqlite')
+    p.add_argument('filename')
+    p.add_argument('--format', choices=('jsonl', 'csv', 'sqlite'), default='jsonl',
+                   help='output format (default: %(default)s)')
+    p.add_argument('--output',
+                   help='output file (default: stdout, except for sqlite)')
+    p = commands.add_parser('serve', help='answer lookups over http, reloading on new versions')
+    p.add_argument('filename')
+    p.add_argument('--address', default='127.0.0.1',
+                   help='address to listen on (default: %(default)s)')
+    p.add_argument('--port', type=int, default=8047,
+                   help='port to listen on (default: %(default)s)')
+    p.add_argument('--socket', help='listen on this unix socket instead')
+    p.add_argument('--threads', type=int, default=8,
+                   help='number of threads answering requests (default: %(default)s)')
+    p.add_argument('--interval', type=float, default=1.0,
+                   help='seconds between checks of the ubik version (default: %(default)s)')
+    p.add_argument('--verbose', action='store_true', help='log each request')
+    p = commands.add_parser('bench', help='time the entry scan of a synthetic vldb')
+    p.add_argument('--volumes', type=int, default=500000,
+                   help='number of volumes (default: %(default)s)')
+    p.add_argument('--servers', type=int, default=100,
+                   help='number of servers (default: %(default)s)')
+    p.add_argument('--lookups', type=int, default=20000,
+                   help='number of names to look up (default: %(default)s)')
+    p.add_argument('--filename',
+                   help='keep the synthetic vldb in this file (default: a temporary file)')
+
+    # The demo was the only thing done before there were commands.
+    argv = argv[1:]
+    if argv and argv[0] not in commands.choices and not argv[0].startswith('-'):
+        argv = ['demo'] + argv
+    args = parser.parse_args(argv)
+
+    if args.command == 'demo':
+        demo(args)
+    elif args.command == 'verify':
+        return verify(args)
+    elif args.command == 'diff':
+        return diff(args)
+    elif args.command == 'volumes':
+        return volumes(args)
+    elif args.command == 'servers':
+        return servers(args)
+    elif args.command == 'report':
+        return report(args)
+    elif args.command == 'export':
+        return export(args)
+    elif args.command == 'serve':
+        return serve(args)
+    elif args.command == 'bench':
+        bench(args)
+    else:
+        parser.error('a command is required')
+
 if __name__ == '__main__':
-    main(sys.argv)
+    sys.exit(main(sys.argv))